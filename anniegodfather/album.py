@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from anniegodfather.jobs import MediaGroup, MediaJob
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+
+# Telegram не собирает в альбом больше 10 файлов
+MAX_GROUP_SIZE = 10
+
+
+class MediaGroupCollector:
+    """
+    Собирает сообщения альбома в одну задачу.
+
+    Альбом приходит отдельными апдейтами с общим media_group_id. Задачи копятся,
+    пока в течение окна приходят новые файлы альбома, затем уходят одной группой.
+    """
+
+    def __init__(self, submit: Callable[[MediaGroup], Awaitable[int]], window: float = None):
+        self.submit = submit
+        self.window = window or config.ALBUM_WINDOW
+        self._groups: dict[str, list[MediaJob]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._flushing: set[asyncio.Task] = set()
+
+    async def add(self, job: MediaJob) -> None:
+        key = job.media_group_id
+        jobs = self._groups.setdefault(key, [])
+        jobs.append(job)
+
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if len(jobs) >= MAX_GROUP_SIZE:
+            await self._flush(key)
+            return
+        self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._schedule_flush, key)
+
+    def _schedule_flush(self, key: str) -> None:
+        task = asyncio.create_task(self._flush(key))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, key: str) -> None:
+        self._timers.pop(key, None)
+        jobs = self._groups.pop(key, None)
+        if not jobs:
+            return
+        logger.info("Collected album %s of %d files", key, len(jobs))
+        await self.submit(MediaGroup(key, jobs))
+
+    async def close(self) -> None:
+        """Отдаёт накопленные альбомы, не дожидаясь окна"""
+        for timer in self._timers.values():
+            timer.cancel()
+        for key in list(self._groups):
+            await self._flush(key)
+        await asyncio.gather(*self._flushing, return_exceptions=True)
@@ -16,7 +16,16 @@ from telethon import TelegramClient
 from logger import logger
 from settings import config
 from clients import DadClient
+from anniegodfather.album import MediaGroupCollector
+from anniegodfather.dedup import DedupIndex
+from anniegodfather.downloader import ParallelDownloader
 from anniegodfather.handlers import default_router, cmd_router, media_router
+from anniegodfather.journal import TransferJournal
+from anniegodfather.preprocess import AVAILABLE as PREPROCESS_AVAILABLE, MediaPreprocessor
+from anniegodfather.pipeline import MediaPipeline, spool_name
+from anniegodfather.scheduler import TransferScheduler
+from anniegodfather.spool import SpoolManager
+from anniegodfather.uploader import S3Uploader
 
 MB = 1 << 20
 
@@ -30,9 +39,27 @@ async def main() -> None:
     client = TelegramClient(f"sessions/media_session", config.API_ID, config.API_HASH)
     telethon_client = await client.start(bot_token=config.TELEGRAM_TOKEN)
 
-    dad = DadClient("127.0.0.1:8081", config.DAD_API_KEY)
+    dad = DadClient(config.DAD_TARGETS, config.DAD_API_KEY)
+    downloader = ParallelDownloader(telethon_client)
+    uploader = S3Uploader()
+    dedup = DedupIndex.from_config()
+    journal = TransferJournal(config.JOURNAL_DB_PATH)
+    spool = SpoolManager()
+    preprocessor = None
+    if config.PREPROCESS_MEDIA:
+        if PREPROCESS_AVAILABLE:
+            preprocessor = MediaPreprocessor()
+        else:
+            logger.warning("Pillow is not installed, media preprocessing is disabled")
+    pipeline = MediaPipeline(bot, dad, telethon_client, downloader, uploader, dedup, journal, spool, preprocessor)
+    scheduler = TransferScheduler(pipeline, journal=journal)
+    await scheduler.start()
+    resumed = await scheduler.resume()
+    # Недокачанные файлы незавершённых задач оставляем, остальное - мусор после падения
+    spool.cleanup(keep=[spool.path(spool_name(job)) for job in resumed])
+    collector = MediaGroupCollector(scheduler.submit)
 
-    dp.update.outer_middleware(ClientMiddleware(dad, telethon_client))
+    dp.update.outer_middleware(ClientMiddleware(dad, telethon_client, downloader, uploader, scheduler, collector, dedup))
     dp.update.outer_middleware(ErrorMiddleware())
 
     dp.include_routers(cmd_router, media_router)
@@ -40,8 +67,19 @@ async def main() -> None:
 
 
 
-    await dp.start_polling(bot, )
-    await telethon_client.disconnect()
+    try:
+        await dp.start_polling(bot, )
+    finally:
+        await collector.close()
+        await scheduler.stop()
+        await uploader.close()
+        await dedup.close()
+        await journal.close()
+        await downloader.close()
+        if preprocessor is not None:
+            preprocessor.close()
+        await dad.close()
+        await telethon_client.disconnect()
 
 if __name__ == "__main__":
     logger.info("Starting Annie bot")
@@ -1,23 +1,50 @@
 
 import asyncio
+import base64
+import functools
+import heapq
+import json
+import random
 
 import jwt
 import time
 
-from collections import defaultdict
+from collections.abc import Awaitable, Callable, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 
-from typing import Optional, Any, get_type_hints
+from typing import Optional, Any, get_args, get_type_hints
 
 import grpc
+from redis import asyncio as aioredis
 
+from anniegodfather.cache import SingleFlight, TTLCache
+from anniegodfather.channels import ChannelManager
 from anniegodfather.exceptions import AuthManagerError, AuthLoginUserNotFoundError, AuthRefreshAccessTokenError, AuthBotLoginError
 from anniegodfather.proto import auth_pb2_grpc, auth_pb2
 from grpc import aio
 from anniegodfather.logger import logger
+from anniegodfather.metrics import metrics
+from anniegodfather.settings import config
 
+# Пользователь, от имени которого идёт текущий gRPC вызов. grpc.aio выполняет
+# интерсепторы в задаче, созданной при вызове stub, поэтому значение из контекста
+# вызывающего доходит до intercept_unary_unary и не смешивается между пользователями
+current_user: ContextVar[int | None] = ContextVar("current_user", default=None)
 
-@dataclass
+
+@functools.cache
+def _field_types(cls: type) -> dict[str, tuple[type, ...]]:
+    """Допустимые типы полей класса, Optional[X] раскрывается в X. Считается один раз на класс"""
+    types = {}
+    for name, hint in get_type_hints(cls).items():
+        args = tuple(arg for arg in get_args(hint) if arg is not type(None))
+        types[name] = args or (hint,)
+    return types
+
+
+@dataclass(slots=True)
 class TokenData:
     access_token: Optional[str] = None
     refresh_token: Optional[str] = None
@@ -36,8 +63,14 @@ class TokenData:
 
     @staticmethod
     def decode_jwt_exp(token: str) -> float:
+        # exp читаем из payload сами, подпись всё равно не проверяем
         try:
-            # Декодируем без проверки подписи, только для получения exp
+            payload = token.split(".")[1]
+            return float(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+        except (IndexError, KeyError, TypeError, ValueError):
+            pass
+        try:
+            # Нестандартный токен - отдаём разбор библиотеке
             payload = jwt.JWT().decode(message=token, do_verify=False)
             exp = payload.get('exp')
             return float(exp)
@@ -46,90 +79,361 @@ class TokenData:
 
     def safe_update(self, **kwargs):
         """Безопасное обновление с проверкой типов и None"""
-        type_hints = get_type_hints(self.__class__)
+        field_types = _field_types(self.__class__)
 
         for key, value in kwargs.items():
-            if value is not None and hasattr(self, key):
-                # update expires fields
-                match key:
-                    case "access_token":
-                        self._access_expires_at = self.decode_jwt_exp(value) - 10
-                    case "refresh_token":
-                        self._refresh_expires_at = self.decode_jwt_exp(value) - 300
-                # Проверка типа
-                expected_type = type_hints.get(key)
-                if expected_type and not isinstance(value, expected_type):
-                    # Для Optional типов проверяем внутренний тип
-                    if hasattr(expected_type, '__args__'):
-                        inner_type = expected_type.__args__[0]
-                        if not isinstance(value, inner_type):
-                            continue
-                setattr(self, key, value)
+            # Значение неподходящего типа пропускаем
+            if value is None or key not in field_types or not isinstance(value, field_types[key]):
+                continue
+            # update expires fields
+            match key:
+                case "access_token":
+                    self._access_expires_at = self.decode_jwt_exp(value) - 10
+                case "refresh_token":
+                    self._refresh_expires_at = self.decode_jwt_exp(value) - 300
+            setattr(self, key, value)
         return self
 
 class TokenInMemoryStorage:
-    def __init__(self):
-        self.token_storage = defaultdict(TokenData)
-        self.lock = asyncio.Lock()
+    """
+    Токены пользователей в памяти.
+
+    Чтение идёт без блокировок: ни в get_tokens, ни в safe_update нет await,
+    поэтому читатель не может увидеть пару токенов посреди обновления. Записи
+    упорядочиваются striped lock по ключу, так что пользователи из разных полос
+    не ждут друг друга.
+
+    Хранилище ограничено: запись живёт, пока не истекут её токены, а сверх
+    capacity вытесняются давно не использованные пользователи. Просроченные
+    записи, к которым никто не обращается, вычищаются раз в purge_interval.
+    """
+
+    def __init__(self, capacity: int = None, stripes: int = 64, purge_interval: float = None):
+        self.token_storage = TTLCache(capacity or config.TOKEN_CACHE_SIZE)
+        self.purge_interval = purge_interval or config.TOKEN_PURGE_INTERVAL
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self._purged_at = time.monotonic()
+        self._size = metrics.gauge("token_storage_size")
+        self._evictions = metrics.gauge("token_storage_evictions")
+        self._expirations = metrics.gauge("token_storage_expirations")
 
-    async def upsert_tokens(self, user_id: int, access: str = None, refresh: str = None):
-        async with self.lock:
+    @property
+    def size(self) -> int:
+        return len(self.token_storage)
+
+    @property
+    def evictions(self) -> int:
+        return self.token_storage.evictions
+
+    @property
+    def expirations(self) -> int:
+        return self.token_storage.expirations
 
-            data = self.token_storage[user_id]
+    def _lock(self, key: Any) -> asyncio.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    async def upsert_tokens(self, user_id: int, access: str = None, refresh: str = None):
+        async with self._lock(user_id):
+            data = self.token_storage.get(user_id) or TokenData()
             data.safe_update(access_token=access, refresh_token=refresh)
-            return data
+            expires_at = max(data.access_expires_at or 0, data.refresh_expires_at or 0)
+            self.token_storage.put(user_id, data, ttl=expires_at - time.time())
+        self._maintain()
+        return data
 
     async def clear(self, key: Any) -> TokenData | None:
-        async with self.lock:
-            return self.token_storage.pop(key)
+        async with self._lock(key):
+            entry = self.token_storage.pop(key)
+        self._maintain()
+        return entry[0] if entry else None
 
     async def get_tokens(self, key: Any) -> tuple[str | None, str | None]:
-        async with self.lock:
-            data = self.token_storage.get(key)
-            if not data:
-                return None, None
+        data = self.token_storage.get(key)
+        if not data:
+            return None, None
+
+        # Просроченный токен не отдаём, запись целиком уйдёт по TTL
+        now = time.time()
+        access_token = data.access_token if data.access_token and now <= data.access_expires_at else None
+        refresh_token = data.refresh_token if data.refresh_token and now <= data.refresh_expires_at else None
+        return access_token, refresh_token
+
+    def _maintain(self) -> None:
+        now = time.monotonic()
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            self.token_storage.purge()
+        self._size.set(self.size)
+        self._evictions.set(self.evictions)
+        self._expirations.set(self.expirations)
+
+class RedisTokenStorage:
+    """
+    Токены в Redis, общие для всех реплик бота, с L1 кешем в памяти процесса.
+
+    Интерфейс как у TokenInMemoryStorage. Пока access токен в L1 действует, Redis
+    не трогаем. Иначе читаем Redis: другая реплика могла уже обновить токены.
+    Промахи, случившиеся за один проход event loop, читаются одним pipeline.
+    Ключ живёт до истечения refresh токена. Если Redis недоступен, работаем
+    только с L1, как TokenInMemoryStorage.
+    """
+
+    prefix = "godfather:tokens:"
+
+    def __init__(self, url: str = None, client: "aioredis.Redis" = None):
+        self._redis = client if client is not None else aioredis.from_url(url or config.REDIS_URL)
+        self.local = TokenInMemoryStorage()
+        self._pending: dict[Any, asyncio.Future] = {}
+        self._reads: set[asyncio.Task] = set()
+
+    def _key(self, user_id: Any) -> str:
+        return f"{self.prefix}{user_id}"
+
+    async def upsert_tokens(self, user_id: int, access: str = None, refresh: str = None):
+        if (access is None or refresh is None) and user_id not in self.local.token_storage:
+            # Частичное обновление: вторую половину пары берём из Redis
+            await self._safe_load(user_id)
+        data = await self.local.upsert_tokens(user_id, access, refresh)
+        fields = {name: value for name, value in (("access", access), ("refresh", refresh)) if value is not None}
+        expires_at = data.refresh_expires_at or data.access_expires_at
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self._key(user_id), mapping=fields)
+                if expires_at:
+                    pipe.expireat(self._key(user_id), int(expires_at))
+                await pipe.execute()
+        except Exception as err:
+            logger.warning("Failed to save tokens of %s to redis: %s", user_id, err)
+        return data
 
-            # Check for expiration
-            if data.access_token and time.time() > data.access_expires_at:
-                data.access_token = None
-            if data.refresh_token and time.time() > data.refresh_expires_at:
-                data.refresh_token = None
+    async def clear(self, key: Any) -> TokenData | None:
+        try:
+            await self._redis.delete(self._key(key))
+        except Exception as err:
+            logger.warning("Failed to delete tokens of %s from redis: %s", key, err)
+        return await self.local.clear(key)
+
+    async def get_tokens(self, key: Any) -> tuple[str | None, str | None]:
+        access_token, refresh_token = await self.local.get_tokens(key)
+        if access_token is not None:
+            return access_token, refresh_token
+        await self._safe_load(key)
+        return await self.local.get_tokens(key)
+
+    async def _safe_load(self, key: Any) -> None:
+        try:
+            await self._load(key)
+        except Exception as err:
+            logger.warning("Failed to read tokens of %s from redis: %s", key, err)
+
+    async def _load(self, key: Any) -> None:
+        """Перечитывает токены пользователя из Redis в L1"""
+        future = self._pending.get(key)
+        if future is None:
+            if not self._pending:
+                asyncio.get_running_loop().call_soon(self._flush)
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+        raw = await asyncio.shield(future)
+        if raw:
+            await self.local.upsert_tokens(key, _decode(raw.get(b"access")), _decode(raw.get(b"refresh")))
+
+    def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        task = asyncio.create_task(self._read(pending))
+        self._reads.add(task)
+        task.add_done_callback(self._reads.discard)
+
+    async def _read(self, pending: dict[Any, asyncio.Future]) -> None:
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key in pending:
+                    pipe.hgetall(self._key(key))
+                results = await pipe.execute()
+        except Exception as err:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for future, raw in zip(pending.values(), results):
+            if not future.done():
+                future.set_result(raw)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def _decode(value: bytes | None) -> str | None:
+    return value.decode() if value is not None else None
+
+
+def token_storage_from_config() -> TokenInMemoryStorage | RedisTokenStorage:
+    match config.TOKEN_BACKEND:
+        case "redis":
+            return RedisTokenStorage(config.REDIS_URL)
+        case _:
+            return TokenInMemoryStorage()
+
+
+class TokenRefreshScheduler:
+    """
+    Фоновое обновление access токенов незадолго до истечения.
+
+    Сроки лежат в min-heap, фоновая задача спит до ближайшего. Обновляются только
+    пользователи, делавшие запросы за последние idle_window секунд, остальные
+    получат токен лениво при следующем запросе. Одновременно идёт не больше
+    concurrency обновлений, срок каждого сдвинут на случайный jitter, чтобы
+    выданные одновременно токены не обновлялись одной пачкой. Раньше середины
+    оставшейся жизни токена обновление не планируется.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[int], Awaitable[Any]],
+        lead: float = None,
+        jitter: float = None,
+        concurrency: int = None,
+        idle_window: float = None,
+    ):
+        self.refresh = refresh
+        self.lead = lead if lead is not None else config.TOKEN_REFRESH_LEAD
+        self.jitter = jitter if jitter is not None else config.TOKEN_REFRESH_JITTER
+        self.idle_window = idle_window or config.TOKEN_REFRESH_IDLE_WINDOW
+        self.last_seen: dict[int, float] = {}
+        self._heap: list[tuple[float, int]] = []
+        # Актуальный срок пользователя, более старые записи в heap пропускаются
+        self._deadlines: dict[int, float] = {}
+        self._slots = asyncio.Semaphore(concurrency or config.TOKEN_REFRESH_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._inflight: set[asyncio.Task] = set()
+
+    def touch(self, user_id: int) -> None:
+        # Активность нужна только тем, у кого есть срок обновления, иначе last_seen растёт без конца
+        if user_id in self._deadlines:
+            self.last_seen[user_id] = time.monotonic()
+
+    def schedule(self, user_id: int, expires_at: float) -> None:
+        if expires_at is None:
+            return
+        # Для короткоживущего токена lead может быть больше всей его жизни, тогда срок
+        # оказался бы в прошлом и каждое обновление сразу планировало бы следующее
+        early = min(self.lead + random.uniform(0, self.jitter), (expires_at - time.time()) / 2)
+        deadline = expires_at - max(early, 0)
+        self._deadlines[user_id] = deadline
+        heapq.heappush(self._heap, (deadline, user_id))
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="token-refresh")
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            deadline, user_id = self._heap[0]
+            delay = deadline - time.time()
+            if delay > 0:
+                # Проснёмся раньше, если появится более близкий срок
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if self._deadlines.get(user_id) != deadline:
+                continue
+            del self._deadlines[user_id]
+            last_seen = self.last_seen.get(user_id)
+            if last_seen is None or time.monotonic() - last_seen > self.idle_window:
+                self.last_seen.pop(user_id, None)
+                continue
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._refresh_user(user_id))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _refresh_user(self, user_id: int) -> None:
+        try:
+            await self.refresh(user_id)
+        except Exception as err:
+            logger.warning("Background token refresh for %s failed: %s", user_id, err)
+        finally:
+            self._slots.release()
+            # Без нового срока пользователь больше не отслеживается
+            if user_id not in self._deadlines:
+                self.last_seen.pop(user_id, None)
+
+    async def stop(self) -> None:
+        tasks = [*self._inflight, self._task] if self._task is not None else list(self._inflight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
 
-            return data.access_token, data.refresh_token
 
 class AuthInterceptor(aio.UnaryUnaryClientInterceptor):
-    def __init__(self, server: str, api_key: str):
-        # создаём отдельный канал и stub для AuthService
-        self.token_storage = TokenInMemoryStorage()
-        self._auth_channel = grpc.aio.insecure_channel(server)
-        self._auth_stub = auth_pb2_grpc.AuthServiceStub(self._auth_channel)
-        self._current_user: int = None
-        self._api_key_metadata = ('x-api-key', api_key)
-        self.whitelistmethods = ["/main.AuthService/RegisterTelegram"]
+    def __init__(self, server: str | Sequence[str], api_key: str, channels: ChannelManager = None):
+        self.token_storage = token_storage_from_config()
+        # stub для AuthService без interceptors, соединение общее с клиентом
+        self._own_channels = channels is None
+        self.channels = channels or ChannelManager()
+        self._auth_stub = auth_pb2_grpc.AuthServiceStub(self.channels.balanced(server))
+        self._api_key_metadata = (('x-api-key', api_key),)
+        # Один login/refresh на пользователя, остальные вызовы ждут его результат
+        self._token_flight = SingleFlight()
+        self.refresher = TokenRefreshScheduler(self._renew_tokens) if config.TOKEN_REFRESH_ENABLED else None
+        # Методы без токена пользователя. gRPC передаёт имя метода в bytes
+        self.whitelistmethods = frozenset({b"/main.AuthService/RegisterTelegram"})
 
     async def save_tokens(self, user_id: int, access: str, refresh: str):
-        await self.token_storage.upsert_tokens(user_id, access, refresh)
+        await self._store_tokens(user_id, access, refresh)
+        if self.refresher is not None:
+            self.refresher.touch(user_id)
+
+    async def _store_tokens(self, user_id: int, access: str, refresh: str) -> None:
+        data = await self.token_storage.upsert_tokens(user_id, access, refresh)
+        if self.refresher is not None:
+            self.refresher.schedule(user_id, data.access_expires_at)
+
+    async def close(self) -> None:
+        if self.refresher is not None:
+            await self.refresher.stop()
+        if isinstance(self.token_storage, RedisTokenStorage):
+            await self.token_storage.close()
+        if self._own_channels:
+            await self.channels.close()
 
-    async def set_current_user(self, user_id: int) -> None:
-        self._current_user = user_id
+    @staticmethod
+    @contextmanager
+    def as_user(user_id: int):
+        """Вызовы stub внутри блока идут с токенами пользователя user_id"""
+        token = current_user.set(user_id)
+        try:
+            yield
+        finally:
+            current_user.reset(token)
 
-    async def _refresh_access_token(self, refresh_token: str) -> tuple[str, str]:
+    async def _refresh_access_token(self, user_id: int, refresh_token: str) -> tuple[str, str]:
         req = auth_pb2.RefreshRequest(refresh_token=refresh_token)
         try:
-            resp = await self._auth_stub.RefreshToken(req, metadata=[self._api_key_metadata])
-            await self.token_storage.upsert_tokens(user_id=self._current_user, access=resp.access_token, refresh=resp.refresh_token)
+            resp = await self._auth_stub.RefreshToken(req, metadata=self._api_key_metadata)
+            await self._store_tokens(user_id, resp.access_token, resp.refresh_token)
             return resp.access_token, resp.refresh_token
         except grpc.aio.AioRpcError as e:
             if e.code() == grpc.StatusCode.UNAUTHENTICATED:
-                return await self._login_user()
+                return await self._login_user(user_id)
+            raise AuthRefreshAccessTokenError(e)
         except Exception as err:
             raise AuthRefreshAccessTokenError(err)
 
-    async def _login_user(self) -> tuple[str, str]:
-        req = auth_pb2.TelegramLoginRequest(telegram_id=self._current_user)
+    async def _login_user(self, user_id: int) -> tuple[str, str]:
+        req = auth_pb2.TelegramLoginRequest(telegram_id=user_id)
         try:
-            resp = await self._auth_stub.LoginTelegram(req, metadata=[self._api_key_metadata])
-            await self.token_storage.upsert_tokens(user_id=self._current_user, access=resp.access_token, refresh=resp.refresh_token)
+            resp = await self._auth_stub.LoginTelegram(req, metadata=self._api_key_metadata)
+            await self._store_tokens(user_id, resp.access_token, resp.refresh_token)
             return resp.access_token, resp.refresh_token
         except grpc.aio.AioRpcError as e:
             if e.code() == grpc.StatusCode.NOT_FOUND:
@@ -138,51 +442,43 @@ class AuthInterceptor(aio.UnaryUnaryClientInterceptor):
         except Exception as err:
             raise AuthBotLoginError(err)
 
-
-    # === перехват gRPC вызовов ===
-    async def intercept_unary_unary(self, continuation, client_call_details, request):
-        logger.debug(f"AUTH INTERCEPTOR: serve method {client_call_details.method}")
-        if client_call_details.method.decode("utf-8") in self.whitelistmethods:
-            return await continuation(client_call_details, request)
-
-        access_token, refresh_token = await self.token_storage.get_tokens(self._current_user)
+    async def _obtain_tokens(self, user_id: int) -> tuple[str, str]:
+        """Логин или refresh для пользователя. Вызывается одним вызовом на пользователя за раз"""
+        # Токены мог только что получить предыдущий login/refresh этого пользователя
+        access_token, refresh_token = await self.token_storage.get_tokens(user_id)
         match access_token, refresh_token:
             case None, None:
-                access_token, refresh_token = await self._login_user()
+                return await self._login_user(user_id)
             case None, str():
-                access_token, refresh_token = await self._refresh_access_token(refresh_token=refresh_token)
-            case str(), str():
-                pass
-
-        # метаданные
-        metadata = list(client_call_details.metadata or [])
-        if access_token:
-            metadata.append(('authorization', f'{access_token}'))
-
-        new_details = grpc.aio.ClientCallDetails(
-            method=client_call_details.method,
-            timeout=client_call_details.timeout,
-            metadata=tuple(metadata),
-            credentials=client_call_details.credentials,
-            wait_for_ready=client_call_details.wait_for_ready,
-        )
+                return await self._refresh_access_token(user_id, refresh_token=refresh_token)
+        return access_token, refresh_token
 
-        return await continuation(new_details, request)
+    async def _renew_tokens(self, user_id: int) -> tuple[str, str]:
+        """Обновляет ещё действующие токены заранее. Делит flight с ленивым обновлением"""
+
+        async def renew():
+            _, refresh_token = await self.token_storage.get_tokens(user_id)
+            if refresh_token is None:
+                return await self._login_user(user_id)
+            return await self._refresh_access_token(user_id, refresh_token=refresh_token)
 
-class AddApiKeyInterceptor(aio.UnaryUnaryClientInterceptor):
-    def __init__(self, api_key):
-        self.api_key = ('x-api-key', api_key)
+        return await self._token_flight.do(user_id, renew)
 
+    # === перехват gRPC вызовов ===
     async def intercept_unary_unary(self, continuation, client_call_details, request):
-        metadata = list(client_call_details.metadata or [])
-        metadata.append(self.api_key)
-
-        new_details = grpc.aio.ClientCallDetails(
-            method=client_call_details.method,
-            timeout=client_call_details.timeout,
-            metadata=tuple(metadata),
-            credentials=client_call_details.credentials,
-            wait_for_ready=client_call_details.wait_for_ready,
-        )
-
-        return await continuation(new_details, request)
\ No newline at end of file
+        """API ключ и токен пользователя добавляются за один проход, без промежуточных списков"""
+        metadata = client_call_details.metadata
+        if client_call_details.method in self.whitelistmethods:
+            extra = self._api_key_metadata
+        else:
+            user_id = current_user.get()
+            access_token, refresh_token = await self.token_storage.get_tokens(user_id)
+            if access_token is None:
+                access_token, refresh_token = await self._token_flight.do(user_id, lambda: self._obtain_tokens(user_id))
+            if self.refresher is not None:
+                # После получения токенов, когда срок обновления уже назначен
+                self.refresher.touch(user_id)
+            extra = self._api_key_metadata + (('authorization', access_token),) if access_token else self._api_key_metadata
+
+        new_details = client_call_details._replace(metadata=tuple(metadata) + extra if metadata else extra)
+        return await continuation(new_details, request)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class LRUCache:
+    """Простой LRU кеш фиксированной ёмкости поверх OrderedDict"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class TTLCache(LRUCache):
+    """LRU кеш, у каждой записи свой срок жизни (по time.monotonic)"""
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = super().get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self.pop(key)
+            self.expirations += 1
+            return default
+        return value
+
+    def put(self, key: Hashable, value: Any, ttl: float = 0) -> None:
+        super().put(key, (value, time.monotonic() + ttl))
+
+    def purge(self) -> int:
+        """Удаляет все просроченные записи, в том числе те, к которым больше не обращаются"""
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._data.items() if now >= expires_at]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом.
+
+    Первый вызов выполняет функцию, остальные ждут и получают тот же результат или ошибку.
+    Если первый вызов отменили, ждущие не отменяются: один из них выполняет функцию заново.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        while (future := self._calls.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменили не этот вызов, а ведущий - становимся в очередь за новым
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку могут так и не забрать, если ждущих нет
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import grpc
+from grpc import aio
+
+from anniegodfather.logger import logger
+from anniegodfather.metrics import metrics
+from anniegodfather.settings import config
+
+COMPRESSION = {
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+# Каналы с одинаковыми аргументами делят одно HTTP/2 соединение через общий пул
+# subchannel в grpc core, поэтому номер канала в пуле передаётся отдельным аргументом
+CHANNEL_INDEX_ARG = "godfather.channel_index"
+
+
+def channel_options() -> list[tuple[str, Any]]:
+    """Keepalive и лимиты размера сообщений из настроек"""
+    options = [
+        ("grpc.max_send_message_length", config.GRPC_MAX_MESSAGE_SIZE),
+        ("grpc.max_receive_message_length", config.GRPC_MAX_MESSAGE_SIZE),
+    ]
+    if config.GRPC_KEEPALIVE_TIME:
+        options += [
+            ("grpc.keepalive_time_ms", int(config.GRPC_KEEPALIVE_TIME * 1000)),
+            ("grpc.keepalive_timeout_ms", int(config.GRPC_KEEPALIVE_TIMEOUT * 1000)),
+            ("grpc.keepalive_permit_without_calls", int(config.GRPC_KEEPALIVE_WITHOUT_CALLS)),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+    return options
+
+
+class _PooledUnaryUnary:
+    """Multicallable поверх пула: каждый вызов уходит в наименее загруженный канал"""
+
+    def __init__(self, pool: "ChannelPool", method: str, **kwargs):
+        self._pool = pool
+        self._method = method
+        self._kwargs = kwargs
+        self._callables: list[aio.UnaryUnaryMultiCallable] = []
+
+    async def __call__(self, request, **kwargs):
+        # Не через add_done_callback: если interceptor падает не с AioRpcError,
+        # grpc не вызывает callback и счётчик вызовов канала утекает
+        index = self._pool.acquire()
+        try:
+            while len(self._callables) <= index:
+                channel = self._pool.channels[len(self._callables)]
+                self._callables.append(channel.unary_unary(self._method, **self._kwargs))
+            return await self._callables[index](request, **kwargs)
+        finally:
+            self._pool.release(index)
+
+
+class ChannelPool:
+    """
+    Каналы к одному target с общими настройками.
+
+    Сервер ограничивает число одновременных stream на соединение, поэтому
+    новый канал (и своё соединение) открывается, только когда на всех открытых
+    уже max_streams вызовов, и не больше size каналов. Пул реализует unary_unary,
+    так что stub создаётся поверх него как поверх обычного канала.
+    """
+
+    def __init__(
+        self,
+        manager: "ChannelManager",
+        target: str,
+        interceptors: Sequence[aio.ClientInterceptor] = (),
+        size: int = None,
+        max_streams: int = None,
+    ):
+        self.manager = manager
+        self.target = target
+        self.interceptors = list(interceptors)
+        self.size = size or config.GRPC_CHANNEL_POOL_SIZE
+        self.max_streams = max_streams or config.GRPC_MAX_STREAMS_PER_CHANNEL
+        self.channels: list[aio.Channel] = []
+        self.inflight: list[int] = []
+        self._watchers: list[asyncio.Task] = []
+        self._drained: asyncio.Event = None
+
+    def unary_unary(self, method: str, **kwargs) -> _PooledUnaryUnary:
+        return _PooledUnaryUnary(self, method, **kwargs)
+
+    def acquire(self) -> int:
+        index = min(range(len(self.inflight)), key=self.inflight.__getitem__, default=None)
+        if index is None or (self.inflight[index] >= self.max_streams and len(self.channels) < self.size):
+            index = self._open()
+        self.inflight[index] += 1
+        return index
+
+    def release(self, index: int) -> None:
+        # Пул могли закрыть, пока вызов был в полёте
+        if index < len(self.inflight):
+            self.inflight[index] -= 1
+            if self._drained is not None and not self.outstanding:
+                self._drained.set()
+
+    @property
+    def outstanding(self) -> int:
+        return sum(self.inflight)
+
+    async def ready(self, timeout: float) -> bool:
+        """Активная проверка: удаётся ли установить соединение за timeout"""
+        if not self.channels:
+            self._open()
+        try:
+            await asyncio.wait_for(self.channels[0].channel_ready(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _open(self) -> int:
+        index = len(self.channels)
+        options = [*self.manager.options, (CHANNEL_INDEX_ARG, index)]
+        channel = aio.insecure_channel(
+            self.target, options=options, compression=self.manager.compression, interceptors=self.interceptors
+        )
+        self.channels.append(channel)
+        self.inflight.append(0)
+        self._watchers.append(asyncio.create_task(self.manager.watch(channel, self.target)))
+        if index:
+            logger.info("Opened gRPC channel %d to %s", index + 1, self.target)
+        return index
+
+    async def close(self, grace: float = None) -> None:
+        if grace and self.outstanding:
+            # Вызовы, уже взявшие канал, дорабатывают до grace секунд
+            self._drained = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._drained.wait(), grace)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._watchers:
+            task.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        await asyncio.gather(*(channel.close() for channel in self.channels))
+        self._watchers.clear()
+        self.channels.clear()
+        self.inflight.clear()
+
+
+class _BalancedUnaryUnary:
+    """Multicallable поверх BalancedChannel. UNAVAILABLE повторяется один раз на другом экземпляре"""
+
+    def __init__(self, balancer: "BalancedChannel", method: str, **kwargs):
+        self._balancer = balancer
+        self._method = method
+        self._kwargs = kwargs
+        self._callables: dict[str, _PooledUnaryUnary] = {}
+
+    def _callable(self, backend: "Backend") -> _PooledUnaryUnary:
+        multicallable = self._callables.get(backend.address)
+        # Адрес мог выпасть из DNS и вернуться с новым пулом
+        if multicallable is None or multicallable._pool is not backend.pool:
+            multicallable = self._callables[backend.address] = backend.pool.unary_unary(self._method, **self._kwargs)
+        return multicallable
+
+    async def __call__(self, request, **kwargs):
+        backend = self._balancer.pick()
+        try:
+            return await self._callable(backend)(request, **kwargs)
+        except aio.AioRpcError as err:
+            if err.code() != grpc.StatusCode.UNAVAILABLE:
+                raise
+            self._balancer.eject(backend)
+            retry = self._balancer.pick(exclude=backend)
+            if retry.address == backend.address:
+                raise
+            logger.debug("AnnieDad %s is unavailable, retrying on %s", backend.address, retry.address)
+            return await self._callable(retry)(request, **kwargs)
+
+
+class TargetHealth:
+    """
+    Адреса и здоровье экземпляров одного набора targets.
+
+    targets - адреса host:port и DNS имена вида dns:///host:port, имя раскрывается
+    во все его адреса и периодически резолвится заново. Экземпляр исключается из
+    ротации, если вызов к нему вернул UNAVAILABLE или не прошла активная проверка
+    соединения, и возвращается, когда проверка снова проходит. Состояние одно на
+    набор targets и общее для всех BalancedChannel к нему, так что резолв и
+    проверки идут одним циклом. Пулы адресов, выпавших из резолва, закрываются.
+    """
+
+    def __init__(
+        self,
+        manager: "ChannelManager",
+        targets: Sequence[str],
+        health_interval: float = None,
+        health_timeout: float = None,
+    ):
+        self.manager = manager
+        self.targets = list(targets)
+        self.health_interval = health_interval or config.GRPC_HEALTH_INTERVAL
+        self.health_timeout = health_timeout or config.GRPC_HEALTH_TIMEOUT
+        # До первого резолва DNS имя отдаётся резолверу grpc как есть
+        self.addresses: list[str] = list(dict.fromkeys(self.targets))
+        self.healthy: dict[str, bool] = dict.fromkeys(self.addresses, True)
+        self._resolved: dict[str, list[str]] = {}
+        self._healthy = metrics.gauge("dad_backends_healthy")
+        self._ejections = metrics.counter("dad_backend_ejections")
+        self._task = None
+        if len(self.targets) > 1 or any(_dns_name(target) for target in self.targets):
+            self._task = asyncio.create_task(self._health_loop())
+
+    def eject(self, address: str) -> None:
+        if self.healthy.get(address):
+            self.healthy[address] = False
+            self._ejections.inc()
+            self._healthy.set(sum(self.healthy.values()))
+            logger.warning("AnnieDad %s removed from rotation", address)
+
+    async def _update(self, addresses: Sequence[str]) -> None:
+        addresses = list(dict.fromkeys(addresses))
+        if not addresses or addresses == self.addresses:
+            return
+        dropped = [address for address in self.addresses if address not in addresses]
+        # Новый список, а не правка на месте: BalancedChannel сверяет его по идентичности
+        self.addresses = addresses
+        self.healthy = {address: self.healthy.get(address, True) for address in addresses}
+        await self.manager.retire(dropped, grace=self.health_timeout)
+
+    async def _resolve(self) -> list[str]:
+        addresses = []
+        for target in self.targets:
+            name = _dns_name(target)
+            if name is None:
+                addresses.append(target)
+                continue
+            host, port = name.rsplit(":", 1)
+            try:
+                infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            except OSError as err:
+                # Остаёмся на адресах прошлого резолва
+                logger.warning("Failed to resolve %s: %s", target, err)
+            else:
+                self._resolved[target] = [
+                    f"[{sockaddr[0]}]:{port}" if family == socket.AF_INET6 else f"{sockaddr[0]}:{port}"
+                    for family, *_, sockaddr in infos
+                ]
+            addresses += self._resolved.get(target, [target])
+        return addresses
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self._update(await self._resolve())
+            # Проверяется пул без interceptors, соединение у него общее с остальными пулами к адресу
+            addresses = self.addresses
+            results = await asyncio.gather(
+                *(self.manager.channel(address).ready(self.health_timeout) for address in addresses)
+            )
+            for address, ready in zip(addresses, results):
+                healthy = self.healthy[address]
+                if ready and not healthy:
+                    logger.info("AnnieDad %s is back in rotation", address)
+                elif not ready and healthy:
+                    self._ejections.inc()
+                    logger.warning("AnnieDad %s failed health check", address)
+                self.healthy[address] = ready
+            self._healthy.set(sum(self.healthy.values()))
+            await asyncio.sleep(self.health_interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+@dataclass(eq=False)
+class Backend:
+    """Экземпляр сервиса в ротации BalancedChannel"""
+
+    address: str
+    pool: ChannelPool
+    health: TargetHealth
+
+    @property
+    def healthy(self) -> bool:
+        return self.health.healthy.get(self.address, False)
+
+
+class BalancedChannel:
+    """
+    Вызовы к нескольким экземплярам AnnieDad.
+
+    Адреса и здоровье экземпляров берутся из общего TargetHealth, у канала только
+    свои пулы с его interceptors. Вызов уходит в здоровый экземпляр с наименьшим
+    числом вызовов в полёте (least_request) или по кругу (round_robin). Если
+    здоровых нет, вызовы идут во все.
+    """
+
+    def __init__(
+        self,
+        manager: "ChannelManager",
+        targets: Sequence[str],
+        interceptors: Sequence[aio.ClientInterceptor] = (),
+        policy: str = None,
+    ):
+        self.manager = manager
+        self.targets = list(targets)
+        self.interceptors = list(interceptors)
+        self.policy = policy or config.GRPC_LB_POLICY
+        self.health = manager.health(targets)
+        self.backends: list[Backend] = []
+        self._addresses: list[str] = None
+        self._next = 0
+
+    def unary_unary(self, method: str, **kwargs) -> _BalancedUnaryUnary:
+        return _BalancedUnaryUnary(self, method, **kwargs)
+
+    def pick(self, exclude: Backend = None) -> Backend:
+        self._sync()
+        excluded = exclude.address if exclude is not None else None
+        candidates = [b for b in self.backends if b.healthy and b.address != excluded]
+        if not candidates:
+            candidates = [b for b in self.backends if b.address != excluded] or self.backends
+        self._next += 1
+        if self.policy == "round_robin":
+            return candidates[self._next % len(candidates)]
+        # Сдвиг начала по кругу, чтобы при равной нагрузке не выбирать всегда первый
+        start = self._next % len(candidates)
+        return min(candidates[start:] + candidates[:start], key=lambda b: b.pool.outstanding)
+
+    def eject(self, backend: Backend) -> None:
+        self.health.eject(backend.address)
+
+    def _sync(self) -> None:
+        """Пересобирает backends, если TargetHealth сменил список адресов"""
+        if self._addresses is self.health.addresses:
+            return
+        current = {backend.address: backend for backend in self.backends}
+        self.backends = []
+        for address in self.health.addresses:
+            pool = self.manager.channel(address, self.interceptors)
+            backend = current.get(address)
+            if backend is None or backend.pool is not pool:
+                backend = Backend(address, pool, self.health)
+            self.backends.append(backend)
+        self._addresses = self.health.addresses
+
+
+def _dns_name(target: str) -> str | None:
+    """host:port из dns:///host:port или dns:host:port"""
+    if target.startswith("dns:"):
+        return target.removeprefix("dns:").lstrip("/")
+    return None
+
+
+class ChannelManager:
+    """
+    Общие gRPC каналы процесса с keepalive, лимитами сообщений и сжатием из настроек.
+
+    На каждый target и набор interceptors заводится один ChannelPool. Пулы с разными
+    interceptors к одному target всё равно идут через одно соединение. Для нескольких
+    экземпляров сервиса balanced() распределяет вызовы между их пулами, здоровье
+    экземпляров одно на набор targets. Состояния каналов считаются в метриках
+    grpc_channels_<state>.
+    """
+
+    def __init__(self, options: list[tuple[str, Any]] = None, compression: str = None):
+        self.options = options if options is not None else channel_options()
+        self.compression = COMPRESSION.get(compression or config.GRPC_COMPRESSION)
+        self._pools: dict[tuple, ChannelPool] = {}
+        self._balancers: dict[tuple, BalancedChannel] = {}
+        self._health: dict[tuple, TargetHealth] = {}
+        self._states = {state: metrics.gauge(f"grpc_channels_{state.name.lower()}") for state in grpc.ChannelConnectivity}
+        self._failures = metrics.counter("grpc_channel_failures")
+
+    def channel(self, target: str, interceptors: Sequence[aio.ClientInterceptor] = ()) -> ChannelPool:
+        key = (target, *interceptors)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = ChannelPool(self, target, interceptors)
+        return pool
+
+    def balanced(self, targets: str | Sequence[str], interceptors: Sequence[aio.ClientInterceptor] = ()) -> BalancedChannel:
+        targets = (targets,) if isinstance(targets, str) else tuple(targets)
+        key = (targets, *interceptors)
+        balancer = self._balancers.get(key)
+        if balancer is None:
+            balancer = self._balancers[key] = BalancedChannel(self, targets, interceptors)
+        return balancer
+
+    def health(self, targets: Sequence[str]) -> TargetHealth:
+        targets = tuple(targets)
+        health = self._health.get(targets)
+        if health is None:
+            health = self._health[targets] = TargetHealth(self, targets)
+        return health
+
+    async def retire(self, addresses: Sequence[str], grace: float = None) -> None:
+        """Закрывает пулы адресов, которых больше нет ни в одном наборе targets"""
+        in_use = {address for health in self._health.values() for address in health.addresses}
+        retired = {address for address in addresses if address not in in_use}
+        pools = [self._pools.pop(key) for key in list(self._pools) if key[0] in retired]
+        for address in retired:
+            logger.info("AnnieDad %s is no longer resolved, closing its channels", address)
+        await asyncio.gather(*(pool.close(grace) for pool in pools))
+
+    async def watch(self, channel: aio.Channel, target: str) -> None:
+        state = channel.get_state()
+        self._states[state].value += 1
+        try:
+            while True:
+                await channel.wait_for_state_change(state)
+                new_state = channel.get_state()
+                self._states[state].value -= 1
+                self._states[new_state].value += 1
+                if new_state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+                    self._failures.inc()
+                    logger.warning("gRPC channel to %s failed", target)
+                state = new_state
+        finally:
+            self._states[state].value -= 1
+
+    async def close(self) -> None:
+        await asyncio.gather(*(health.close() for health in self._health.values()))
+        self._health.clear()
+        self._balancers.clear()
+        await asyncio.gather(*(pool.close() for pool in self._pools.values()))
+        self._pools.clear()
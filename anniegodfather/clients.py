@@ -1,30 +1,200 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from datetime import datetime, timezone
 from typing import Any
+from urllib.parse import parse_qs, urlsplit
 
 import grpc
-from grpc import aio
 
-from anniegodfather.auth import AuthInterceptor, AddApiKeyInterceptor
-from anniegodfather.exceptions import DadClientRegistrationError, DadClientRegistrationAlreadyExistException
+from anniegodfather.auth import AuthInterceptor
+from anniegodfather.cache import SingleFlight, TTLCache
+from anniegodfather.channels import ChannelManager
+from anniegodfather.exceptions import (
+    DadClientPresignError,
+    DadClientRegistrationError,
+    DadClientRegistrationAlreadyExistException,
+)
 from anniegodfather.logger import logger
+from anniegodfather.metrics import SIZE_BUCKETS, metrics
 from anniegodfather.proto import (
     anniedad_pb2_grpc as father_grpc,
     anniedad_pb2 as father_pb2,
     auth_pb2_grpc as auth_grpc,
     auth_pb2 as auth_pb2
 )
+from anniegodfather.settings import config
+
+
+class PresignBatcher:
+    """
+    Склеивает одновременные запросы presigned URL одного пользователя в один batch RPC.
+
+    Запросы копятся в течение окна или пока не наберётся max_size, затем уходят
+    одним вызовом, а результаты раздаются ожидающим. Пачки собираются по
+    telegram_id, потому что RPC идёт с токеном конкретного пользователя.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch_batch: Callable[[list[str], int], Awaitable[list[str]]],
+        window: float = None,
+        max_size: int = None,
+    ):
+        self.name = name
+        self.fetch_batch = fetch_batch
+        self.window = window or config.PRESIGN_BATCH_WINDOW
+        self.max_size = max_size or config.PRESIGN_BATCH_MAX_SIZE
+        self._pending: dict[int, list[tuple[str, asyncio.Future]]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._inflight: set[asyncio.Task] = set()
+        self._batch_size = metrics.histogram(f"presign_{name}_batch_size", SIZE_BUCKETS)
+        self._rpc_latency = metrics.histogram(f"presign_{name}_rpc_seconds")
+        self._wait_latency = metrics.histogram(f"presign_{name}_wait_seconds")
+
+    async def fetch(self, filename: str, telegram_id: int = None) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(telegram_id, [])
+        batch.append((filename, future))
+        if len(batch) >= self.max_size:
+            self._flush(telegram_id)
+        elif len(batch) == 1:
+            self._timers[telegram_id] = loop.call_later(self.window, self._flush, telegram_id)
+
+        started = time.perf_counter()
+        try:
+            return await future
+        finally:
+            self._wait_latency.observe(time.perf_counter() - started)
+
+    def _flush(self, telegram_id: int) -> None:
+        timer = self._timers.pop(telegram_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(telegram_id, None)
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(telegram_id, batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, telegram_id: int, batch: list[tuple[str, asyncio.Future]]) -> None:
+        self._batch_size.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            urls = await self.fetch_batch([filename for filename, _ in batch], telegram_id)
+        except Exception as err:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        finally:
+            self._rpc_latency.observe(time.perf_counter() - started)
+
+        if len(urls) != len(batch):
+            err = DadClientPresignError(f"backend returned {len(urls)} urls for {len(batch)} files")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        for (_, future), url in zip(batch, urls):
+            if not future.done():
+                future.set_result(url)
+
+
+def presigned_url_ttl(url: str, margin: float) -> float:
+    """Сколько секунд ещё можно отдавать presigned URL с запасом margin. 0 если срок неизвестен"""
+    query = parse_qs(urlsplit(url).query)
+    try:
+        signed_at = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        expires = int(query["X-Amz-Expires"][0])
+    except (KeyError, ValueError):
+        return 0
+    # Запас не меньше 10% от срока, чтобы ссылка не истекла у пользователя в руках
+    margin = max(margin, expires * 0.1)
+    return max(0.0, signed_at.timestamp() + expires - margin - time.time())
+
+
+class PresignedURLCache:
+    """
+    LRU+TTL кеш presigned GET URL по (telegram_id, filename).
+
+    Запись живёт до X-Amz-Date + X-Amz-Expires за вычетом запаса. Одновременные
+    промахи по одному ключу делают один запрос к бэкенду.
+    """
+
+    def __init__(self, capacity: int = None, margin: float = None):
+        self.margin = margin if margin is not None else config.GET_URL_CACHE_MARGIN
+        self._cache = TTLCache(capacity or config.GET_URL_CACHE_SIZE)
+        self._flight = SingleFlight()
+        self._hits = metrics.counter("get_url_cache_hits")
+        self._misses = metrics.counter("get_url_cache_misses")
+        self._coalesced = metrics.counter("get_url_cache_coalesced")
+
+    @property
+    def hits(self) -> int:
+        return self._hits.value
+
+    @property
+    def misses(self) -> int:
+        return self._misses.value
+
+    @property
+    def coalesced(self) -> int:
+        return self._coalesced.value
+
+    async def get(self, telegram_id: int, filename: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        key = (telegram_id, filename)
+        url = self._cache.get(key)
+        if url is not None:
+            self._hits.inc()
+            return url
+
+        # Промах, к которому уже идёт запрос, к бэкенду не ходит
+        if key in self._flight:
+            self._coalesced.inc()
+        else:
+            self._misses.inc()
+        return await self._flight.do(key, lambda: self._load(key, fetch))
+
+    async def _load(self, key: tuple[int, str], fetch: Callable[[], Awaitable[str]]) -> str:
+        url = await fetch()
+        ttl = presigned_url_ttl(url, self.margin)
+        if ttl > 0:
+            self._cache.put(key, url, ttl)
+        return url
 
 
 class DadClient:
-    def __init__(self, server: str, bot_api_key: str):
-        self.auth_interceptor = AuthInterceptor(server, bot_api_key)
-        api_key_interceptor = AddApiKeyInterceptor(bot_api_key)
-        aio_channel = aio.insecure_channel(server, interceptors=[api_key_interceptor, self.auth_interceptor])
+    def __init__(
+        self,
+        server: str | Sequence[str],
+        bot_api_key: str,
+        batching: bool = None,
+        channels: ChannelManager = None,
+    ):
+        """server - адрес AnnieDad или список адресов экземпляров, между которыми распределяются вызовы"""
+        self.channels = channels or ChannelManager()
+        self.auth_interceptor = AuthInterceptor(server, bot_api_key, self.channels)
+        aio_channel = self.channels.balanced(server, interceptors=[self.auth_interceptor])
         auth_stub = auth_grpc.AuthServiceStub(aio_channel)
         self.media_stub = father_grpc.MediaStub(aio_channel)
         self.auth_stub = auth_stub
         self._api_key_metadata = ('x-api-key', bot_api_key)
+        self._post_batcher = None
+        self._get_batcher = None
+        self.get_url_cache = PresignedURLCache() if config.GET_URL_CACHE_SIZE else None
+        if batching if batching is not None else config.PRESIGN_BATCHING:
+            self._post_batcher = PresignBatcher("post", self.fetch_post_urls)
+            self._get_batcher = PresignBatcher("get", self.fetch_get_urls)
 
+    async def close(self) -> None:
+        await self.auth_interceptor.close()
+        await self.channels.close()
 
     async def register_user(self, telegram_id: int, username: str):
         request = auth_pb2.TelegramRegisterRequest(telegram_id=telegram_id, username=username)
@@ -40,15 +210,81 @@ class DadClient:
             raise DadClientRegistrationError()
 
     async def fetch_post_url(self, filename: str, telegram_id: int = None):
-        await self.auth_interceptor.set_current_user(telegram_id)
+        if self._post_batcher is not None:
+            return await self._post_batcher.fetch(filename, telegram_id)
+        return await self._post_url(filename, telegram_id)
+
+    async def _post_url(self, filename: str, telegram_id: int = None) -> str:
         request = father_pb2.PostMediaRequest(filename=filename)
-        resp = await self.media_stub.PostURL(request)
+        with self.auth_interceptor.as_user(telegram_id):
+            resp = await self.media_stub.PostURL(request)
         return resp.url
 
+    async def fetch_post_urls(self, filenames: list[str], telegram_id: int = None) -> list[str]:
+        """Gets presigned S3 post urls for several files in one call"""
+        return await self._fetch_list(self.media_stub.PostListURL, self._post_url, filenames, telegram_id)
+
     async def fetch_get_url(self, filename: str, telegram_id=None) -> Any:
         """Gets presighned S3 get url from anniedad backend"""
-        await self.auth_interceptor.set_current_user(telegram_id)
+        if self.get_url_cache is not None:
+            url = await self.get_url_cache.get(telegram_id, filename, lambda: self._fetch_get_url(filename, telegram_id))
+        else:
+            url = await self._fetch_get_url(filename, telegram_id)
+        return father_pb2.GetMediaResponse(url=url)
+
+    async def _fetch_get_url(self, filename: str, telegram_id: int = None) -> str:
+        if self._get_batcher is not None:
+            return await self._get_batcher.fetch(filename, telegram_id)
+        return await self._get_url(filename, telegram_id)
+
+    async def _get_url(self, filename: str, telegram_id: int = None) -> str:
         request = father_pb2.GetMediaRequest(filename=filename)
-        resp = await self.media_stub.GetURL(request)
+        with self.auth_interceptor.as_user(telegram_id):
+            resp = await self.media_stub.GetURL(request)
+        return resp.url
+
+    async def fetch_get_urls(self, filenames: list[str], telegram_id: int = None) -> list[str]:
+        """Gets presigned S3 get urls for several files in one call"""
+        return await self._fetch_list(self.media_stub.GetListURLByName, self._get_url, filenames, telegram_id)
+
+    async def _fetch_list(self, batch_rpc, single, filenames: list[str], telegram_id: int = None) -> list[str]:
+        request = father_pb2.ListMediaRequest(filenames=filenames)
+        try:
+            with self.auth_interceptor.as_user(telegram_id):
+                resp = await batch_rpc(request)
+        except grpc.aio.AioRpcError as err:
+            if err.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            # Старый anniedad без batch метода
+            logger.debug("Batch presign is not implemented on backend, fetching urls one by one")
+            return list(await asyncio.gather(*(single(name, telegram_id) for name in filenames)))
+        return list(resp.url)
+
+    async def create_multipart_upload(self, filename: str, parts: int, telegram_id: int = None) -> tuple[str, list[str]]:
+        """Starts S3 multipart upload, returns upload id and presigned url for every part"""
+        request = father_pb2.MultipartUploadRequest(filename=filename, parts=parts)
+        with self.auth_interceptor.as_user(telegram_id):
+            resp = await self.media_stub.CreateMultipartUpload(request)
+        return resp.upload_id, list(resp.urls)
+
+    async def presign_upload_parts(
+        self, filename: str, upload_id: str, part_numbers: list[int], telegram_id: int = None
+    ) -> list[str]:
+        """Presigns parts of already started multipart upload, e.g. when resuming it"""
+        request = father_pb2.MultipartPartsRequest(filename=filename, upload_id=upload_id, part_numbers=part_numbers)
+        with self.auth_interceptor.as_user(telegram_id):
+            resp = await self.media_stub.PresignUploadParts(request)
+        return list(resp.urls)
+
+    async def complete_multipart_upload(
+        self, filename: str, upload_id: str, etags: list[str], telegram_id: int = None
+    ) -> None:
+        parts = [father_pb2.CompletedPart(part_number=i, etag=etag) for i, etag in enumerate(etags, start=1)]
+        request = father_pb2.CompleteMultipartRequest(filename=filename, upload_id=upload_id, parts=parts)
+        with self.auth_interceptor.as_user(telegram_id):
+            await self.media_stub.CompleteMultipartUpload(request)
 
-        return resp
\ No newline at end of file
+    async def abort_multipart_upload(self, filename: str, upload_id: str, telegram_id: int = None) -> None:
+        request = father_pb2.AbortMultipartRequest(filename=filename, upload_id=upload_id)
+        with self.auth_interceptor.as_user(telegram_id):
+            await self.media_stub.AbortMultipartUpload(request)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import json
+import sqlite3
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass
+
+from redis import asyncio as aioredis
+
+from anniegodfather.cache import LRUCache
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+
+
+@dataclass
+class StoredMedia:
+    """Уже загруженный в S3 файл"""
+
+    object_name: str
+    sha256: str = None
+    thumbnail: str = None
+    phash: str = None
+
+
+class SQLiteDedupStore:
+    """Персистентное хранилище индекса в SQLite. Запросы выполняются в отдельном потоке"""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media (key TEXT PRIMARY KEY, object_name TEXT NOT NULL, sha256 TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(media)")}
+        for column in ("thumbnail", "phash"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE media ADD COLUMN {column} TEXT")
+        self._db.commit()
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> StoredMedia | None:
+        async with self._lock:
+            row = await asyncio.to_thread(self._fetch, key)
+        return StoredMedia(*row) if row else None
+
+    def _fetch(self, key: str):
+        return self._db.execute("SELECT object_name, sha256, thumbnail, phash FROM media WHERE key = ?", (key,)).fetchone()
+
+    async def put(self, key: str, media: StoredMedia) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._store, key, media)
+
+    def _store(self, key: str, media: StoredMedia) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO media (key, object_name, sha256, thumbnail, phash) VALUES (?, ?, ?, ?, ?)",
+            (key, media.object_name, media.sha256, media.thumbnail, media.phash),
+        )
+        self._db.commit()
+
+    async def close(self) -> None:
+        self._db.close()
+
+
+class RedisDedupStore:
+    """Персистентное хранилище индекса в Redis, общее для всех реплик бота"""
+
+    prefix = "godfather:dedup:"
+
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+
+    async def get(self, key: str) -> StoredMedia | None:
+        raw = await self._redis.get(self.prefix + key)
+        return StoredMedia(**json.loads(raw)) if raw else None
+
+    async def put(self, key: str, media: StoredMedia) -> None:
+        await self._redis.set(self.prefix + key, json.dumps(asdict(media)))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class DedupIndex:
+    """
+    Индекс уже загруженных файлов по file_unique_id.
+
+    file_unique_id одинаков для всех пересылок одного файла, поэтому повторную
+    загрузку можно пропустить. Ключ включает telegram_id: объекты в S3 принадлежат
+    пользователю, и чужой файл ему не отдать. Горячие записи держатся в LRU в памяти,
+    полный индекс - в SQLite или Redis.
+    """
+
+    def __init__(self, store: SQLiteDedupStore | RedisDedupStore = None, capacity: int = None):
+        self.store = store
+        self.memory = LRUCache(capacity or config.DEDUP_CACHE_SIZE)
+
+    @classmethod
+    def from_config(cls) -> "DedupIndex":
+        match config.DEDUP_BACKEND:
+            case "redis":
+                store = RedisDedupStore(config.REDIS_URL)
+            case "sqlite":
+                store = SQLiteDedupStore(config.DEDUP_DB_PATH)
+            case _:
+                store = None
+        return cls(store)
+
+    @staticmethod
+    def key(telegram_id: int, file_unique_id: str) -> str:
+        return f"{telegram_id}:{file_unique_id}"
+
+    async def get(self, telegram_id: int, file_unique_id: str) -> StoredMedia | None:
+        if not file_unique_id:
+            return None
+        key = self.key(telegram_id, file_unique_id)
+        media = self.memory.get(key)
+        if media is None and self.store is not None:
+            try:
+                media = await self.store.get(key)
+            except Exception as err:
+                # Индекс - оптимизация, при его недоступности просто грузим файл заново
+                logger.warning("Dedup store lookup failed: %s", err)
+                return None
+            if media is not None:
+                self.memory.put(key, media)
+        return media
+
+    async def put(self, telegram_id: int, file_unique_id: str, media: StoredMedia) -> None:
+        if not file_unique_id:
+            return
+        key = self.key(telegram_id, file_unique_id)
+        self.memory.put(key, media)
+        if self.store is not None:
+            try:
+                await self.store.put(key, media)
+            except Exception as err:
+                logger.warning("Dedup store update failed: %s", err)
+
+    async def close(self) -> None:
+        if self.store is not None:
+            await self.store.close()
+
+
+async def hashing(stream: AsyncIterator[bytes], digest: "hashlib._Hash") -> AsyncIterator[bytes]:
+    """Пропускает поток через себя, по пути считая хеш содержимого"""
+    async for chunk in stream:
+        digest.update(chunk)
+        yield chunk
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import inspect
+import itertools
+import math
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+
+import aiofiles
+import aiohttp
+from aiogram import Bot
+from telethon import TelegramClient, utils
+from telethon.errors import TimedOutError
+from telethon.network import MTProtoSender
+from telethon.tl import functions
+from telethon.tl.alltlobjects import LAYER
+
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+from anniegodfather.throttle import inbound, throttled
+
+ProgressCallback = Callable[[int, int], Any]
+
+
+def stream_bot_file(bot: Bot, file_path: str, chunk_size: int = None, offset: int = 0) -> AsyncIterator[bytes]:
+    """Отдаёт файл из Bot API чанками, не сохраняя его на диск. offset - с какого байта начать"""
+    return throttled(_bot_file_chunks(bot, file_path, chunk_size, offset), inbound)
+
+
+async def _bot_file_chunks(bot: Bot, file_path: str, chunk_size: int = None, offset: int = 0) -> AsyncIterator[bytes]:
+    chunk_size = chunk_size or config.STREAM_CHUNK_SIZE
+    api = bot.session.api
+    if api.is_local:
+        async with aiofiles.open(api.wrap_local_file.to_local(file_path), "rb") as f:
+            await f.seek(offset)
+            while chunk := await f.read(chunk_size):
+                yield chunk
+        return
+
+    url = api.file_url(bot.token, file_path)
+    if offset:
+        async for chunk in _stream_range(bot, url, chunk_size, offset):
+            yield chunk
+        return
+
+    # stream_content читает сокет только по мере потребления чанков,
+    # поэтому в памяти держится не больше одного чанка на передачу.
+    # Таймаут общий на весь файл, а скорость чтения ограничена скоростью загрузки в S3
+    stream = bot.session.stream_content(
+        url=url, timeout=config.STREAM_TIMEOUT, chunk_size=chunk_size, raise_for_status=True
+    )
+    async for chunk in stream:
+        yield chunk
+
+
+async def _stream_range(bot: Bot, url: str, chunk_size: int, offset: int) -> AsyncIterator[bytes]:
+    """Докачка с offset через Range. Если сервер Range не поддержал - пропускаем лишнее сами"""
+    session = await bot.session.create_session()
+    headers = {"Range": f"bytes={offset}-"}
+    timeout = aiohttp.ClientTimeout(total=config.STREAM_TIMEOUT)
+    async with session.get(url, headers=headers, timeout=timeout, raise_for_status=True) as resp:
+        skip = 0 if resp.status == 206 else offset
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk[skip:], 0
+            yield chunk
+
+
+async def spool_to_disk(stream: AsyncIterator[bytes], file_location: str, append: bool = False) -> int:
+    """Сохраняет поток в файл, возвращает количество записанных байт"""
+    written = 0
+    async with aiofiles.open(file_location, "ab" if append else "wb") as f:
+        async for chunk in stream:
+            await f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+class TelethonSenderPool:
+    """
+    Пул отдельных MTProto соединений к одному DC.
+
+    Telethon качает файл последовательно через один sender, поэтому для
+    параллельной загрузки чанков держим несколько своих соединений.
+    """
+
+    def __init__(self, client: TelegramClient, dc_id: int, size: int):
+        self.client = client
+        self.dc_id = dc_id
+        self.size = size
+        self._senders: list[MTProtoSender] = []
+        self._idle: asyncio.Queue[MTProtoSender] = asyncio.Queue()
+        self._auth_key = client.session.auth_key if client.session.dc_id == dc_id else None
+
+    async def start(self) -> None:
+        for _ in range(self.size):
+            sender = await self._create_sender()
+            self._senders.append(sender)
+            self._idle.put_nowait(sender)
+        logger.info("Opened %d MTProto connections to DC %d", self.size, self.dc_id)
+
+    async def _create_sender(self) -> MTProtoSender:
+        dc = await self.client._get_dc(self.dc_id)
+        sender = MTProtoSender(self._auth_key, loggers=self.client._log)
+        await sender.connect(
+            self.client._connection(
+                dc.ip_address,
+                dc.port,
+                dc.id,
+                loggers=self.client._log,
+                proxy=self.client._proxy,
+                local_addr=self.client._local_addr,
+            )
+        )
+        if self._auth_key is None:
+            # Чужой DC: один раз экспортируем авторизацию, ключ переиспользуем для остальных соединений
+            auth = await self.client(functions.auth.ExportAuthorizationRequest(self.dc_id))
+            self.client._init_request.query = functions.auth.ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(functions.InvokeWithLayerRequest(LAYER, self.client._init_request))
+            self._auth_key = sender.auth_key
+        return sender
+
+    async def request(self, request):
+        sender = await self._idle.get()
+        try:
+            return await self.client._call(sender, request)
+        finally:
+            self._idle.put_nowait(sender)
+
+    async def close(self) -> None:
+        for sender in self._senders:
+            await sender.disconnect()
+        self._senders.clear()
+
+
+class ParallelDownloader:
+    """
+    Параллельная загрузка больших документов через upload.GetFileRequest.
+
+    Чанки файла запрашиваются одновременно через пул соединений к DC, где лежит файл.
+    Результат отдаётся потоком по порядку.
+    """
+
+    def __init__(self, client: TelegramClient, connections: int = None, chunk_size: int = None):
+        self.client = client
+        self.connections = connections or config.TELETHON_CONNECTIONS
+        self.chunk_size = chunk_size or config.TELETHON_CHUNK_SIZE
+        self._pools: dict[int, TelethonSenderPool] = {}
+        self._pools_lock = asyncio.Lock()
+
+    async def _get_pool(self, dc_id: int) -> TelethonSenderPool:
+        async with self._pools_lock:
+            pool = self._pools.get(dc_id)
+            if pool is None:
+                pool = TelethonSenderPool(self.client, dc_id, self.connections)
+                await pool.start()
+                self._pools[dc_id] = pool
+            return pool
+
+    async def close(self) -> None:
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools.clear()
+
+    async def _fetch_chunk(self, pool: TelethonSenderPool, location, index: int) -> bytes:
+        request = functions.upload.GetFileRequest(location, offset=index * self.chunk_size, limit=self.chunk_size)
+        # Полосу резервируем до запроса, иначе параллельные соединения её превысят
+        await inbound.consume(self.chunk_size)
+        try:
+            result = await pool.request(request)
+        except TimedOutError:
+            logger.info("Timeout while fetching chunk %d, retrying once", index)
+            result = await pool.request(request)
+        return result.bytes
+
+    async def _run(
+        self, media, size: int, consume: Callable[[int, bytes], Any], window: asyncio.Semaphore = None, start: int = 0
+    ):
+        dc_id, location = utils.get_input_location(media)
+        pool = await self._get_pool(dc_id or self.client.session.dc_id)
+        chunks = math.ceil(size / self.chunk_size)
+        indexes = itertools.count(start)
+
+        async def worker():
+            while True:
+                # Слот окна берём до номера чанка, тогда слоты всегда занимают
+                # самые ранние чанки и потребитель не может зависнуть
+                if window is not None:
+                    await window.acquire()
+                index = next(indexes)
+                if index >= chunks:
+                    return
+                data = await self._fetch_chunk(pool, location, index)
+                await consume(index, data)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(min(self.connections, chunks - start)):
+                    tg.create_task(worker())
+        except BaseExceptionGroup as group:
+            raise group.exceptions[0]
+
+    async def stream(self, media, progress: ProgressCallback = None, offset: int = 0) -> AsyncIterator[bytes]:
+        """
+        Отдаёт чанки строго по порядку, вперёд скачивается не больше 2 * connections чанков.
+        offset - с какого байта начать, для докачки
+        """
+        size = media.document.size
+        start, skip = divmod(offset, self.chunk_size)
+        window = asyncio.Semaphore(2 * self.connections)
+        ready: dict[int, bytes] = {}
+        arrived = asyncio.Event()
+
+        async def consume(index: int, data: bytes):
+            ready[index] = data
+            arrived.set()
+
+        task = asyncio.create_task(self._run(media, size, consume, window, start))
+        task.add_done_callback(lambda _: arrived.set())
+        try:
+            done = offset
+            for index in range(start, math.ceil(size / self.chunk_size)):
+                while index not in ready:
+                    if task.done():
+                        # Загрузка упала или закончилась без нужного чанка
+                        task.result()
+                        raise RuntimeError("chunk %d was not downloaded" % index)
+                    arrived.clear()
+                    await arrived.wait()
+                data = ready.pop(index)
+                window.release()
+                if skip:
+                    data, skip = data[skip:], 0
+                done += len(data)
+                await _report(progress, done, size)
+                yield data
+        finally:
+            task.cancel()
+
+
+async def _report(progress: ProgressCallback, current: int, total: int) -> None:
+    if progress is None:
+        return
+    result = progress(current, total)
+    if inspect.isawaitable(result):
+        await result
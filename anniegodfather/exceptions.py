@@ -6,6 +6,10 @@ class DadClientRegistrationAlreadyExistException(Exception):
     """User already exist exception"""
 
 
+class DadClientPresignError(Exception):
+    """Backend returned unexpected presigned urls"""
+
+
 class AuthManagerError(Exception):
     """General error"""
 
@@ -20,3 +24,16 @@ class AuthRefreshAccessTokenError(Exception):
 
 class AuthBotLoginError(Exception):
     """Error while trying to login in"""
+
+
+class S3UploadError(Exception):
+    """Presigned S3 upload returned non-success status"""
+
+    def __init__(self, status: int, text: str = ""):
+        super().__init__(f"S3 upload failed with status {status}: {text}")
+        self.status = status
+        self.text = text
+
+
+class MediaNotFoundError(Exception):
+    """Media of the message not found in Telegram"""
@@ -1,15 +1,23 @@
 
+from typing import Any
+
 from aiogram import Router, F, html, Bot
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message
 from telethon import TelegramClient
 
 from anniegodfather.clients import DadClient
+from anniegodfather.metrics import metrics
+from anniegodfather.settings import config
+from anniegodfather.throttle import inbound, outbound
 
 cmd_router = Router()
 
+# Ограничение Telegram на длину сообщения
+MESSAGE_LIMIT = 4096
+
 class RegisterUserStates(StatesGroup):
     waiting_for_username = State()
 
@@ -44,3 +52,51 @@ async def process_username(message: Message, state: FSMContext, dad: DadClient,
             raise
     await message.answer(f"User with name {username} and telegram id {telegram_id} successfully registered")
     await state.clear()
+
+
+def format_rate(rate: int) -> str:
+    return f"{rate // 1024} КБ/с" if rate > 0 else "без ограничения"
+
+
+@cmd_router.message(Command(commands=["bandwidth"]), F.from_user.id.in_(config.ADMIN_IDS))
+async def command_bandwidth_handler(message: Message, command: CommandObject):
+    """Показывает или меняет лимиты полосы: /bandwidth <входящий> <исходящий> в КБ/с, 0 - без ограничения"""
+    if command.args:
+        try:
+            rate_in, rate_out = (int(value) * 1024 for value in command.args.split())
+        except ValueError:
+            await message.answer("Использование: /bandwidth <входящий> <исходящий> в КБ/с, 0 - без ограничения")
+            return
+        inbound.set_rate(rate_in)
+        outbound.set_rate(rate_out)
+    await message.answer(f"Входящий: {format_rate(inbound.rate)}, исходящий: {format_rate(outbound.rate)}")
+
+
+def format_metrics(snapshot: dict[str, Any], prefix: str = "") -> list[str]:
+    """Строка на метрику, у гистограмм - число, среднее и непустые бакеты"""
+    lines = []
+    for name, value in snapshot.items():
+        if not name.startswith(prefix):
+            continue
+        if isinstance(value, dict):
+            buckets = " ".join(f"{bound}:{count}" for bound, count in value["buckets"].items() if count)
+            lines.append(f"{name}: count={value['count']} mean={value['mean']:.4g} {buckets}".rstrip())
+        else:
+            lines.append(f"{name}: {round(value, 4)}")
+    return lines
+
+
+@cmd_router.message(Command(commands=["metrics"]), F.from_user.id.in_(config.ADMIN_IDS))
+async def command_metrics_handler(message: Message, command: CommandObject):
+    """Метрики процесса: /metrics [префикс имени], например /metrics token_"""
+    lines = format_metrics(metrics.snapshot(), (command.args or "").strip())
+    if not lines:
+        await message.answer("Метрик нет")
+        return
+    chunk = ""
+    for line in lines:
+        if chunk and len(chunk) + len(line) + 1 > MESSAGE_LIMIT:
+            await message.answer(html.quote(chunk))
+            chunk = ""
+        chunk = f"{chunk}\n{line}" if chunk else line
+    await message.answer(html.quote(chunk))
@@ -3,15 +3,34 @@ from typing import Dict, Any, Awaitable
 
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Update
+from anniegodfather.album import MediaGroupCollector
 from anniegodfather.clients import DadClient
+from anniegodfather.dedup import DedupIndex
+from anniegodfather.downloader import ParallelDownloader
+from anniegodfather.scheduler import TransferScheduler
+from anniegodfather.uploader import S3Uploader
 from anniegodfather.exceptions import DadClientRegistrationAlreadyExistException, AuthLoginUserNotFoundError
 from telethon.client import TelegramClient
 
 
 class ClientMiddleware(BaseMiddleware):
-    def __init__(self, dad: DadClient, telethon: TelegramClient):
+    def __init__(
+        self,
+        dad: DadClient,
+        telethon: TelegramClient,
+        downloader: ParallelDownloader,
+        uploader: S3Uploader,
+        scheduler: TransferScheduler,
+        collector: MediaGroupCollector,
+        dedup: DedupIndex,
+    ):
         self.dad = dad
         self.telethon = telethon
+        self.downloader = downloader
+        self.uploader = uploader
+        self.scheduler = scheduler
+        self.collector = collector
+        self.dedup = dedup
 
     async def __call__(
             self,
@@ -22,6 +41,11 @@ class ClientMiddleware(BaseMiddleware):
         # Добавляем клиент в data
         data['dad'] = self.dad
         data['telethon'] = self.telethon
+        data['downloader'] = self.downloader
+        data['uploader'] = self.uploader
+        data['scheduler'] = self.scheduler
+        data['collector'] = self.collector
+        data['dedup'] = self.dedup
         return await handler(event, data)
 
 
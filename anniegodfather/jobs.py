@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from dataclasses import dataclass
+
+from aiogram.types import Message
+
+from anniegodfather.logger import logger
+
+MB = 1 << 20
+# Bot API не отдаёт файлы больше 20 Мб
+BOT_API_DOWNLOAD_LIMIT = 20 * MB
+
+
+@dataclass
+class MediaJob:
+    """Задача на перенос одного файла из Telegram в S3"""
+
+    chat_id: int
+    message_id: int
+    telegram_id: int
+    file_id: str
+    file_name: str
+    file_size: int = None
+    kind: str = "document"
+    file_unique_id: str = None
+    media_group_id: str = None
+    job_id: int = None
+
+    @property
+    def use_mtproto(self) -> bool:
+        return self.kind == "document" and self.file_size is not None and self.file_size > BOT_API_DOWNLOAD_LIMIT
+
+
+@dataclass
+class MediaGroup:
+    """Альбом: файлы с одним media_group_id, которые переносятся и подтверждаются вместе"""
+
+    media_group_id: str
+    jobs: list[MediaJob]
+
+    @property
+    def job_id(self) -> int:
+        return self.jobs[0].job_id
+
+    @property
+    def file_name(self) -> str:
+        return f"album {self.media_group_id} ({len(self.jobs)} files)"
+
+
+def job_from_message(message: Message) -> MediaJob | None:
+    """Собирает задачу из сообщения с медиа, None если тип медиа не поддерживается"""
+    if message.photo:
+        # Если это фото, берем последний элемент (самое высокое качество)
+        media = message.photo[-1]
+        kind, file_name = "photo", f"photo_{media.file_id}.jpg"
+    elif message.document:
+        # Если это документ, берем file_id и оригинальное имя файла
+        media = message.document
+        kind, file_name = "document", media.file_name
+    elif message.video:
+        media = message.video
+        kind, file_name = "video", f"video_{media.file_id}.mp4"
+    elif message.audio:
+        media = message.audio
+        kind, file_name = "audio", f"audio_{media.file_id}.mp3"
+    else:
+        return None
+
+    logger.info("Catch %s %s" % (kind, file_name))
+    return MediaJob(
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        telegram_id=message.from_user.id,
+        file_id=media.file_id,
+        file_name=file_name,
+        file_size=media.file_size,
+        kind=kind,
+        file_unique_id=media.file_unique_id,
+        media_group_id=message.media_group_id,
+    )
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import sqlite3
+import time
+from dataclasses import asdict
+from enum import StrEnum
+
+from anniegodfather.jobs import MediaJob
+from anniegodfather.uploader import MultipartState
+
+
+class JobState(StrEnum):
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    DOWNLOADED = "downloaded"
+    UPLOADING = "uploading"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# Задачи в этих состояниях после рестарта продолжаются
+UNFINISHED = (JobState.QUEUED, JobState.DOWNLOADING, JobState.DOWNLOADED, JobState.UPLOADING)
+
+
+class TransferJournal:
+    """
+    Журнал задач на перенос медиа в SQLite.
+
+    Хранит задачу, её состояние и прогресс multipart загрузки, чтобы после
+    рестарта продолжить незавершённые задачи с последней загруженной части.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY,
+                job TEXT NOT NULL,
+                state TEXT NOT NULL,
+                upload_id TEXT,
+                part_size INTEGER,
+                etags TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+        self._lock = asyncio.Lock()
+
+    async def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        async with self._lock:
+            return await asyncio.to_thread(self._run, sql, params)
+
+    def _run(self, sql: str, params: tuple) -> list[tuple]:
+        rows = self._db.execute(sql, params).fetchall()
+        self._db.commit()
+        return rows
+
+    async def last_job_id(self) -> int:
+        rows = await self._execute("SELECT COALESCE(MAX(job_id), 0) FROM jobs")
+        return rows[0][0]
+
+    async def add(self, job: MediaJob) -> None:
+        await self._execute(
+            "INSERT OR REPLACE INTO jobs (job_id, job, state, updated_at) VALUES (?, ?, ?, ?)",
+            (job.job_id, json.dumps(asdict(job)), JobState.QUEUED, time.time()),
+        )
+
+    async def set_state(self, job_id: int, state: JobState) -> None:
+        await self._execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?", (state, time.time(), job_id)
+        )
+
+    async def get_state(self, job_id: int) -> JobState | None:
+        rows = await self._execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,))
+        return JobState(rows[0][0]) if rows else None
+
+    async def save_multipart(self, job_id: int, state: MultipartState) -> None:
+        await self._execute(
+            "UPDATE jobs SET upload_id = ?, part_size = ?, etags = ?, updated_at = ? WHERE job_id = ?",
+            (state.upload_id, state.part_size, json.dumps(state.etags), time.time(), job_id),
+        )
+
+    async def load_multipart(self, job_id: int) -> MultipartState | None:
+        rows = await self._execute("SELECT upload_id, part_size, etags FROM jobs WHERE job_id = ?", (job_id,))
+        if not rows or rows[0][0] is None:
+            return None
+        upload_id, part_size, etags = rows[0]
+        # json хранит ключи строками
+        return MultipartState(part_size, upload_id, {int(n): etag for n, etag in json.loads(etags).items()})
+
+    async def unfinished(self) -> list[MediaJob]:
+        placeholders = ", ".join("?" * len(UNFINISHED))
+        rows = await self._execute(
+            f"SELECT job FROM jobs WHERE state IN ({placeholders}) ORDER BY job_id", tuple(UNFINISHED)
+        )
+        return [MediaJob(**json.loads(row[0])) for row in rows]
+
+    async def prune(self) -> None:
+        """Удаляет завершённые задачи"""
+        await self._execute("DELETE FROM jobs WHERE state IN (?, ?)", (JobState.DONE, JobState.FAILED))
+
+    async def close(self) -> None:
+        self._db.close()
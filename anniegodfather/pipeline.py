@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+from functools import partial
+
+import grpc
+from aiogram import Bot
+from aiogram.types import ReplyParameters
+from telethon import TelegramClient
+
+from anniegodfather.clients import DadClient
+from anniegodfather.dedup import DedupIndex, StoredMedia, hashing
+from anniegodfather.downloader import ParallelDownloader, stream_bot_file
+from anniegodfather.exceptions import AuthLoginUserNotFoundError, MediaNotFoundError, S3UploadError
+from anniegodfather.jobs import BOT_API_DOWNLOAD_LIMIT, MediaGroup, MediaJob
+from anniegodfather.journal import JobState, TransferJournal
+from anniegodfather.logger import logger
+from anniegodfather.preprocess import MediaPreprocessor, Preprocessed, scratch_space, thumbnail_name
+from anniegodfather.settings import config
+from anniegodfather.spool import SpoolManager
+from anniegodfather.uploader import MultipartState, S3Uploader
+
+def log_progress(file_name: str, step: int = 10):
+    """Пишет в лог прогресс загрузки файла каждые step процентов"""
+    last = 0
+
+    def callback(current: int, total: int):
+        nonlocal last
+        percent = current * 100 // total
+        if percent >= last + step or current == total:
+            last = percent
+            logger.info("Downloading %s: %d%%", file_name, percent)
+
+    return callback
+
+
+def spool_name(job: MediaJob) -> str:
+    return f"{job.job_id}_{job.file_name}"
+
+
+async def _empty() -> AsyncIterator[bytes]:
+    return
+    yield
+
+
+class MediaPipeline:
+    """
+    Скачивает файл задачи из Telegram, загружает в S3 и отвечает пользователю.
+
+    Состояние задачи и прогресс multipart загрузки пишутся в журнал, поэтому
+    прерванная рестартом задача продолжается с последней загруженной части.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dad: DadClient,
+        telethon: TelegramClient,
+        downloader: ParallelDownloader,
+        uploader: S3Uploader,
+        dedup: DedupIndex = None,
+        journal: TransferJournal = None,
+        spool: SpoolManager = None,
+        preprocessor: MediaPreprocessor = None,
+    ):
+        self.bot = bot
+        self.dad = dad
+        self.telethon = telethon
+        self.downloader = downloader
+        self.uploader = uploader
+        self.dedup = dedup or DedupIndex()
+        self.journal = journal
+        self.spool = spool or SpoolManager()
+        self.preprocessor = preprocessor
+        # Старый anniedad не умеет multipart, тогда большие файлы идут одной ссылкой
+        self.multipart_supported = True
+
+    async def reply(self, job: MediaJob, text: str) -> None:
+        await self.bot.send_message(
+            job.chat_id, text, reply_parameters=ReplyParameters(message_id=job.message_id, allow_sending_without_reply=True)
+        )
+
+    async def _set_state(self, job: MediaJob, state: JobState) -> None:
+        if self.journal is not None:
+            await self.journal.set_state(job.job_id, state)
+
+    async def __call__(self, item: MediaJob | MediaGroup) -> None:
+        if isinstance(item, MediaGroup):
+            await self.process_group(item)
+            return
+        _, text = await self.process(item)
+        await self.reply(item, text)
+
+    async def process(self, job: MediaJob, presigned_url: str = None) -> tuple[bool, str]:
+        """Переносит файл, возвращает признак успеха и текст ответа пользователю"""
+        stored = await self.dedup.get(job.telegram_id, job.file_unique_id)
+        if stored is not None:
+            # Этот файл пользователь уже присылал - не качаем и не грузим повторно
+            logger.info("Skip %s, already stored as %s", job.file_name, stored.object_name)
+            await self._set_state(job, JobState.DONE)
+            return True, f"✅ Файл уже загружен в S3: {stored.object_name}"
+
+        try:
+            stored = await self.transfer(job, presigned_url)
+        except S3UploadError as err:
+            return False, f"⚠️ Ошибка при загрузке ({err.status}): {err.text}"
+        except AuthLoginUserNotFoundError:
+            return False, "Аккаунт не найден. Используйте /register для регистрации"
+        except MediaNotFoundError:
+            return False, "⚠️ Не удалось получить файл из Telegram"
+        except Exception as err:
+            logger.error("Transfer of %s failed: %s", job.file_name, err)
+            return False, f"⚠️ Не удалось загрузить файл {job.file_name}"
+
+        logger.info("File saved to S3 %s" % job.file_name)
+        await self.dedup.put(job.telegram_id, job.file_unique_id, stored)
+        return True, f"✅ Файл загружен в S3: {job.file_name}"
+
+    async def process_group(self, group: MediaGroup) -> None:
+        """Переносит альбом целиком: одна пачка presigned URL, параллельная загрузка, один ответ"""
+        urls = {}
+        batched = [
+            job
+            for job in group.jobs
+            if job.file_size
+            and job.file_size < config.MULTIPART_THRESHOLD
+            and not job.use_mtproto
+            and await self.dedup.get(job.telegram_id, job.file_unique_id) is None
+        ]
+        if batched:
+            try:
+                fetched = await self.dad.fetch_post_urls(
+                    [job.file_name for job in batched], telegram_id=group.jobs[0].telegram_id
+                )
+                urls = {job.job_id: url for job, url in zip(batched, fetched)}
+            except Exception as err:
+                # Ссылки получим по одной в process
+                logger.warning("Failed to presign album %s in one call: %s", group.media_group_id, err)
+
+        # Альбом занимает в очереди USER_MAX_CONCURRENT мест, больше файлов сразу не грузим
+        slots = asyncio.Semaphore(config.USER_MAX_CONCURRENT)
+
+        async def process(job: MediaJob) -> tuple[bool, str]:
+            async with slots:
+                return await self.process(job, urls.get(job.job_id))
+
+        results = await asyncio.gather(*(process(job) for job in group.jobs))
+        succeeded = sum(ok for ok, _ in results)
+        lines = [f"Альбом: загружено {succeeded} из {len(results)}"] + [text for _, text in results]
+        await self.reply(group.jobs[0], "\n".join(lines))
+
+    async def open_source(self, job: MediaJob) -> Callable[[int], AsyncIterator[bytes]]:
+        """Уточняет размер файла и возвращает функцию, открывающую поток с нужного байта"""
+        if job.use_mtproto:
+            # Качаем медиа через MTProto параллельно и отдаём по порядку в загрузчик
+            entity = await self.telethon.get_entity(job.chat_id)
+            message = await self.telethon.get_messages(entity=entity, ids=job.message_id)
+            if not (message and message.media):
+                raise MediaNotFoundError(job.file_name)
+            job.file_size = message.media.document.size
+            progress = log_progress(job.file_name)
+            return lambda offset=0: self.downloader.stream(message.media, progress=progress, offset=offset)
+
+        # Получаем информацию о файле
+        file = await self.bot.get_file(job.file_id)
+        job.file_size = file.file_size or job.file_size
+        return lambda offset=0: stream_bot_file(self.bot, file.file_path, offset=offset)
+
+    async def transfer(self, job: MediaJob, presigned_url: str = None) -> StoredMedia:
+        try:
+            stored = await self._transfer(job, presigned_url)
+        except Exception:
+            await self._set_state(job, JobState.FAILED)
+            raise
+        await self._set_state(job, JobState.DONE)
+        return stored
+
+    async def _transfer(self, job: MediaJob, presigned_url: str = None) -> StoredMedia:
+        # Состояние до рестарта читаем раньше, чем его перезапишет DOWNLOADING
+        resumed = await self.journal.get_state(job.job_id) if self.journal is not None else None
+        downloaded = resumed in (JobState.DOWNLOADED, JobState.UPLOADING)
+        if not downloaded:
+            await self._set_state(job, JobState.DOWNLOADING)
+        open_stream = await self.open_source(job)
+        digest = None
+
+        def stream_from(offset: int = 0) -> AsyncIterator[bytes]:
+            nonlocal digest
+            stream = open_stream(offset)
+            # Хеш имеет смысл только для потока с начала файла
+            if config.DEDUP_CONTENT_HASH and offset == 0:
+                digest = hashlib.sha256()
+                return hashing(stream, digest)
+            digest = None
+            return stream
+
+        preprocessed = Preprocessed()
+        # --- стримим файл сразу в S3 через presigned URL ---
+        if job.file_size and job.file_size >= config.MULTIPART_THRESHOLD and self.multipart_supported:
+            # Большие файлы грузим частями параллельно
+            try:
+                await self._upload_multipart(job, stream_from)
+            except grpc.aio.AioRpcError as err:
+                if err.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+                if self.multipart_supported:
+                    self.multipart_supported = False
+                    logger.warning("Multipart upload is not implemented on backend, uploading large files in one PUT")
+                # Одной presigned ссылкой S3 принимает до 5 Гб
+                await self._upload_stream(job, stream_from, presigned_url)
+        elif job.file_size and job.file_size >= config.MULTIPART_THRESHOLD:
+            await self._upload_stream(job, stream_from, presigned_url)
+        elif self.preprocessor is not None and self.preprocessor.accepts(job):
+            # Фото обрабатываем в пуле процессов, поэтому сначала сохраняем на диск
+            preprocessed = await self._upload_preprocessed(job, stream_from, presigned_url, downloaded)
+        elif job.file_size and config.STREAM_UPLOADS and not self.uploader.retry.hedges(job.file_size):
+            await self._upload_stream(job, stream_from, presigned_url)
+        else:
+            await self._upload_spooled(job, stream_from, presigned_url, downloaded)
+
+        return StoredMedia(
+            job.file_name,
+            digest.hexdigest() if digest else None,
+            thumbnail_name(job.file_name) if preprocessed.thumbnail else None,
+            preprocessed.phash,
+        )
+
+    async def _put(
+        self, job: MediaJob, url: str, put: Callable[[str], Awaitable], object_name: str = None, size: int = None
+    ) -> None:
+        """Загружает с повторами по политике uploader.retry, просроченную ссылку подписывает заново"""
+        refresh = partial(self.dad.fetch_post_url, object_name or job.file_name, telegram_id=job.telegram_id)
+        await self.uploader.retry.run(put, url, refresh, size)
+
+    async def _upload_stream(
+        self, job: MediaJob, stream_from: Callable[[int], AsyncIterator[bytes]], presigned_url: str = None
+    ) -> None:
+        # Получаем подписанную ссылку, если её не выдали заранее пачкой
+        url = presigned_url or await self.dad.fetch_post_url(job.file_name, telegram_id=job.telegram_id)
+        logger.info("GET URL: %s", url)
+        await self._set_state(job, JobState.UPLOADING)
+        # Каждая попытка открывает поток из Telegram заново
+        await self._put(job, url, lambda url: self.uploader.put_stream(url, stream_from(), job.file_size))
+
+    async def _upload_multipart(self, job: MediaJob, stream_from: Callable[[int], AsyncIterator[bytes]]) -> None:
+        state = await self.journal.load_multipart(job.job_id) if self.journal is not None else None
+        multipart = self.uploader.multipart(self.dad, part_size=state.part_size if state else None)
+        state = state or MultipartState(multipart.part_size)
+        offset = multipart.resume_offset(state, job.file_size)
+        stream = stream_from(offset) if offset < job.file_size else _empty()
+
+        on_part = None
+        if self.journal is not None:
+            on_part = partial(self.journal.save_multipart, job.job_id)
+        await self._set_state(job, JobState.UPLOADING)
+        await multipart.upload(
+            job.file_name, stream, job.file_size, telegram_id=job.telegram_id, state=state, on_part=on_part
+        )
+
+    async def _upload_spooled(
+        self,
+        job: MediaJob,
+        stream_from: Callable[[int], AsyncIterator[bytes]],
+        presigned_url: str = None,
+        downloaded: bool = False,
+    ) -> None:
+        """Размер неизвестен, а S3 нужен Content-Length: сначала спулим файл в память или SAVE_FOLDER"""
+        async with self.spool.open(spool_name(job), stream_from, job.file_size, downloaded) as spooled:
+            await self._set_state(job, JobState.DOWNLOADED)
+            url = presigned_url or await self.dad.fetch_post_url(job.file_name, telegram_id=job.telegram_id)
+            logger.info("GET URL: %s", url)
+            await self._set_state(job, JobState.UPLOADING)
+            if spooled.data is not None:
+                await self._put(job, url, partial(self.uploader.put_bytes, data=spooled.data), size=spooled.size)
+            else:
+                await self._put(job, url, partial(self.uploader.put_file, file_location=spooled.path), size=spooled.size)
+
+    async def _upload_preprocessed(
+        self,
+        job: MediaJob,
+        stream_from: Callable[[int], AsyncIterator[bytes]],
+        presigned_url: str = None,
+        downloaded: bool = False,
+    ) -> Preprocessed:
+        """Снимает EXIF, строит превью и хеш, затем грузит оригинал и превью рядом с ним"""
+        name = spool_name(job)
+        scratch = scratch_space(job.file_size or BOT_API_DOWNLOAD_LIMIT)
+        spooling = self.spool.open(name, stream_from, job.file_size, downloaded, memory=False, scratch=scratch)
+        async with spooling as spooled:
+            await self._set_state(job, JobState.DOWNLOADED)
+            # Копия без EXIF пишется рядом: спул остаётся оригиналом, который можно докачать после рестарта
+            clean_path, thumb_path = self.spool.path(f"{name}_clean"), self.spool.path(f"{name}_thumb")
+            try:
+                result = await self.preprocessor.process(spooled.path, clean_path, thumb_path)
+                upload_path = result.clean or spooled.path
+                url = presigned_url or await self.dad.fetch_post_url(job.file_name, telegram_id=job.telegram_id)
+                logger.info("GET URL: %s", url)
+                await self._set_state(job, JobState.UPLOADING)
+                put = partial(self.uploader.put_file, file_location=upload_path)
+                await self._put(job, url, put, size=os.path.getsize(upload_path))
+                if result.thumbnail:
+                    thumb_name = thumbnail_name(job.file_name)
+                    thumb_url = await self.dad.fetch_post_url(thumb_name, telegram_id=job.telegram_id)
+                    put_thumb = partial(self.uploader.put_file, file_location=result.thumbnail)
+                    await self._put(job, thumb_url, put_thumb, thumb_name)
+            finally:
+                for path in (clean_path, thumb_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        return result
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Pillow опционален, без него обработка выключена
+    Image = ImageOps = None
+
+from anniegodfather.jobs import MediaJob
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+
+AVAILABLE = Image is not None
+# Превью JPEG стороной THUMBNAIL_SIZE заведомо меньше мегабайта
+THUMBNAIL_RESERVE = 1024 * 1024
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp", ".heic"}
+
+
+@dataclass
+class Preprocessed:
+    """Результат обработки: копия без метаданных (если они были), превью на диске и перцептивный хеш"""
+
+    thumbnail: str = None
+    phash: str = None
+    clean: str = None
+
+
+def thumbnail_name(file_name: str) -> str:
+    """Имя объекта превью в S3 рядом с оригиналом"""
+    return f"{os.path.splitext(file_name)[0]}_thumb.jpg"
+
+
+def scratch_space(size: int) -> int:
+    """Место на диске рядом с оригиналом: копия без метаданных и превью"""
+    return size + THUMBNAIL_RESERVE
+
+
+def _dhash(image: "Image.Image", size: int = 8) -> str:
+    """Difference hash: сравнивает соседние пиксели уменьшенной серой картинки"""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = value << 1 | (left > pixels[row * (size + 1) + col + 1])
+    return f"{value:0{size * size // 4}x}"
+
+
+def _process_image(path: str, clean_path: str, thumb_path: str, thumb_size: int) -> tuple[str, str, str]:
+    """
+    Выполняется в отдельном процессе, поэтому получает и возвращает только пути и строки.
+
+    Поворачивает картинку по EXIF и сохраняет копию без метаданных в clean_path,
+    исходный файл не меняется. Сохраняет превью в thumb_path и возвращает копию
+    (None, если метаданных не было), превью и хеш.
+    """
+    with Image.open(path) as source:
+        image_format = source.format
+        has_metadata = bool(source.getexif())
+        image = ImageOps.exif_transpose(source)
+
+    clean = None
+    if has_metadata:
+        image.save(clean_path, format=image_format, quality=95)
+        clean = clean_path
+
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((thumb_size, thumb_size))
+    thumbnail.save(thumb_path, format="JPEG", quality=85)
+    return clean, thumb_path, _dhash(image)
+
+
+class MediaPreprocessor:
+    """
+    Обработка фото перед загрузкой в S3 в пуле процессов, чтобы не блокировать event loop.
+
+    Процессам передаются пути к файлам в SAVE_FOLDER, а не содержимое. Одновременно
+    в пул отдаётся не больше workers + queue_size файлов, остальные ждут своей очереди.
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = None, thumb_size: int = None):
+        workers = workers or config.PREPROCESS_WORKERS
+        self.thumb_size = thumb_size or config.THUMBNAIL_SIZE
+        # fork процесса с потоками sqlite и telethon небезопасен
+        self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self._slots = asyncio.Semaphore(workers + (queue_size or config.PREPROCESS_QUEUE_SIZE))
+
+    @staticmethod
+    def accepts(job: MediaJob) -> bool:
+        if job.kind == "photo":
+            return True
+        return job.kind == "document" and os.path.splitext(job.file_name)[1].lower() in IMAGE_EXTENSIONS
+
+    async def process(self, path: str, clean_path: str, thumb_path: str) -> Preprocessed:
+        """
+        Обрабатывает файл, оставляя его нетронутым: докачка после рестарта
+        продолжает именно исходный файл. Ошибка обработки не мешает загрузить оригинал.
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            try:
+                clean, thumbnail, phash = await loop.run_in_executor(
+                    self._executor, _process_image, path, clean_path, thumb_path, self.thumb_size
+                )
+            except Exception as err:
+                logger.warning("Failed to preprocess %s: %s", path, err)
+                return Preprocessed()
+        return Preprocessed(thumbnail, phash, clean)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -25,7 +25,7 @@ _sym_db = _symbol_database.Default()
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n#anniegodfather/proto/anniedad.proto\x12\x04main\x1a\x1bgoogle/protobuf/empty.proto\"$\n\x10PostMediaRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\" \n\x11PostMediaResponse\x12\x0b\n\x03url\x18\x01 \x01(\t\"#\n\x0fGetMediaRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\"\x1f\n\x10GetMediaResponse\x12\x0b\n\x03url\x18\x01 \x01(\t\"!\n\x12GetListURLResponse\x12\x0b\n\x03url\x18\x01 \x03(\t2\xba\x01\n\x05Media\x12:\n\x07PostURL\x12\x16.main.PostMediaRequest\x1a\x17.main.PostMediaResponse\x12\x37\n\x06GetURL\x12\x15.main.GetMediaRequest\x1a\x16.main.GetMediaResponse\x12<\n\nGetListURL\x12\x16.google.protobuf.Empty\x1a\x16.main.GetMediaResponseB;Z9github.com/sebasttiano13/AnnieDad/internal/proto/anniedadb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n#anniegodfather/proto/anniedad.proto\x12\x04main\x1a\x1bgoogle/protobuf/empty.proto\"$\n\x10PostMediaRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\" \n\x11PostMediaResponse\x12\x0b\n\x03url\x18\x01 \x01(\t\"#\n\x0fGetMediaRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\"\x1f\n\x10GetMediaResponse\x12\x0b\n\x03url\x18\x01 \x01(\t\"!\n\x12GetListURLResponse\x12\x0b\n\x03url\x18\x01 \x03(\t\"%\n\x10ListMediaRequest\x12\x11\n\tfilenames\x18\x01 \x03(\t\"9\n\x16MultipartUploadRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\r\n\x05parts\x18\x02 \x01(\x05\":\n\x17MultipartUploadResponse\x12\x11\n\tupload_id\x18\x01 \x01(\t\x12\x0c\n\x04urls\x18\x02 \x03(\t\"2\n\rCompletedPart\x12\x13\n\x0bpart_number\x18\x01 \x01(\x05\x12\x0c\n\x04\x65tag\x18\x02 \x01(\t\"c\n\x18\x43ompleteMultipartRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x11\n\tupload_id\x18\x02 \x01(\t\x12\"\n\x05parts\x18\x03 \x03(\x0b\x32\x13.main.CompletedPart\"R\n\x15MultipartPartsRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x11\n\tupload_id\x18\x02 \x01(\t\x12\x14\n\x0cpart_numbers\x18\x03 \x03(\x05\"<\n\x15\x41\x62ortMultipartRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x11\n\tupload_id\x18\x02 \x01(\t2\x89\x05\n\x05Media\x12:\n\x07PostURL\x12\x16.main.PostMediaRequest\x1a\x17.main.PostMediaResponse\x12\x37\n\x06GetURL\x12\x15.main.GetMediaRequest\x1a\x16.main.GetMediaResponse\x12<\n\nGetListURL\x12\x16.google.protobuf.Empty\x1a\x16.main.GetMediaResponse\x12?\n\x0bPostListURL\x12\x16.main.ListMediaRequest\x1a\x18.main.GetListURLResponse\x12\x44\n\x10GetListURLByName\x12\x16.main.ListMediaRequest\x1a\x18.main.GetListURLResponse\x12T\n\x15\x43reateMultipartUpload\x12\x1c.main.MultipartUploadRequest\x1a\x1d.main.MultipartUploadResponse\x12P\n\x12PresignUploadParts\x12\x1b.main.MultipartPartsRequest\x1a\x1d.main.MultipartUploadResponse\x12Q\n\x17\x43ompleteMultipartUpload\x12\x1e.main.CompleteMultipartRequest\x1a\x16.google.protobuf.Empty\x12K\n\x14\x41\x62ortMultipartUpload\x12\x1b.main.AbortMultipartRequest\x1a\x16.google.protobuf.EmptyB;Z9github.com/sebasttiano13/AnnieDad/internal/proto/anniedadb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -43,6 +43,20 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_GETMEDIARESPONSE']._serialized_end=214
   _globals['_GETLISTURLRESPONSE']._serialized_start=216
   _globals['_GETLISTURLRESPONSE']._serialized_end=249
-  _globals['_MEDIA']._serialized_start=252
-  _globals['_MEDIA']._serialized_end=438
+  _globals['_LISTMEDIAREQUEST']._serialized_start=251
+  _globals['_LISTMEDIAREQUEST']._serialized_end=288
+  _globals['_MULTIPARTUPLOADREQUEST']._serialized_start=290
+  _globals['_MULTIPARTUPLOADREQUEST']._serialized_end=347
+  _globals['_MULTIPARTUPLOADRESPONSE']._serialized_start=349
+  _globals['_MULTIPARTUPLOADRESPONSE']._serialized_end=407
+  _globals['_COMPLETEDPART']._serialized_start=409
+  _globals['_COMPLETEDPART']._serialized_end=459
+  _globals['_COMPLETEMULTIPARTREQUEST']._serialized_start=461
+  _globals['_COMPLETEMULTIPARTREQUEST']._serialized_end=560
+  _globals['_MULTIPARTPARTSREQUEST']._serialized_start=562
+  _globals['_MULTIPARTPARTSREQUEST']._serialized_end=644
+  _globals['_ABORTMULTIPARTREQUEST']._serialized_start=646
+  _globals['_ABORTMULTIPARTREQUEST']._serialized_end=706
+  _globals['_MEDIA']._serialized_start=709
+  _globals['_MEDIA']._serialized_end=1358
 # @@protoc_insertion_point(module_scope)
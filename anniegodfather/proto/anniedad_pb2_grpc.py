@@ -50,6 +50,36 @@ class MediaStub(object):
                 request_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
                 response_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetMediaResponse.FromString,
                 _registered_method=True)
+        self.PostListURL = channel.unary_unary(
+                '/main.Media/PostListURL',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.SerializeToString,
+                response_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.FromString,
+                _registered_method=True)
+        self.GetListURLByName = channel.unary_unary(
+                '/main.Media/GetListURLByName',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.SerializeToString,
+                response_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.FromString,
+                _registered_method=True)
+        self.CreateMultipartUpload = channel.unary_unary(
+                '/main.Media/CreateMultipartUpload',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadRequest.SerializeToString,
+                response_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.FromString,
+                _registered_method=True)
+        self.PresignUploadParts = channel.unary_unary(
+                '/main.Media/PresignUploadParts',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartPartsRequest.SerializeToString,
+                response_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.FromString,
+                _registered_method=True)
+        self.CompleteMultipartUpload = channel.unary_unary(
+                '/main.Media/CompleteMultipartUpload',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.CompleteMultipartRequest.SerializeToString,
+                response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                _registered_method=True)
+        self.AbortMultipartUpload = channel.unary_unary(
+                '/main.Media/AbortMultipartUpload',
+                request_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.AbortMultipartRequest.SerializeToString,
+                response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                _registered_method=True)
 
 
 class MediaServicer(object):
@@ -73,6 +103,42 @@ class MediaServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def PostListURL(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetListURLByName(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CreateMultipartUpload(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PresignUploadParts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CompleteMultipartUpload(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AbortMultipartUpload(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_MediaServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -91,6 +157,36 @@ def add_MediaServicer_to_server(servicer, server):
                     request_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
                     response_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetMediaResponse.SerializeToString,
             ),
+            'PostListURL': grpc.unary_unary_rpc_method_handler(
+                    servicer.PostListURL,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.FromString,
+                    response_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.SerializeToString,
+            ),
+            'GetListURLByName': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetListURLByName,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.FromString,
+                    response_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.SerializeToString,
+            ),
+            'CreateMultipartUpload': grpc.unary_unary_rpc_method_handler(
+                    servicer.CreateMultipartUpload,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadRequest.FromString,
+                    response_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.SerializeToString,
+            ),
+            'PresignUploadParts': grpc.unary_unary_rpc_method_handler(
+                    servicer.PresignUploadParts,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartPartsRequest.FromString,
+                    response_serializer=anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.SerializeToString,
+            ),
+            'CompleteMultipartUpload': grpc.unary_unary_rpc_method_handler(
+                    servicer.CompleteMultipartUpload,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.CompleteMultipartRequest.FromString,
+                    response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+            ),
+            'AbortMultipartUpload': grpc.unary_unary_rpc_method_handler(
+                    servicer.AbortMultipartUpload,
+                    request_deserializer=anniegodfather_dot_proto_dot_anniedad__pb2.AbortMultipartRequest.FromString,
+                    response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'main.Media', rpc_method_handlers)
@@ -182,3 +278,165 @@ class Media(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def PostListURL(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/PostListURL',
+            anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.SerializeToString,
+            anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetListURLByName(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/GetListURLByName',
+            anniegodfather_dot_proto_dot_anniedad__pb2.ListMediaRequest.SerializeToString,
+            anniegodfather_dot_proto_dot_anniedad__pb2.GetListURLResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CreateMultipartUpload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/CreateMultipartUpload',
+            anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadRequest.SerializeToString,
+            anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def PresignUploadParts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/PresignUploadParts',
+            anniegodfather_dot_proto_dot_anniedad__pb2.MultipartPartsRequest.SerializeToString,
+            anniegodfather_dot_proto_dot_anniedad__pb2.MultipartUploadResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CompleteMultipartUpload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/CompleteMultipartUpload',
+            anniegodfather_dot_proto_dot_anniedad__pb2.CompleteMultipartRequest.SerializeToString,
+            google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AbortMultipartUpload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/main.Media/AbortMultipartUpload',
+            anniegodfather_dot_proto_dot_anniedad__pb2.AbortMultipartRequest.SerializeToString,
+            google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
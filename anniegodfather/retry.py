@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import aiohttp
+
+from anniegodfather.exceptions import S3UploadError
+from anniegodfather.logger import logger
+from anniegodfather.metrics import metrics
+from anniegodfather.settings import config
+
+T = TypeVar("T")
+
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5, 8)
+
+
+def is_expired(err: BaseException) -> bool:
+    """S3 отвечает 403 AccessDenied "Request has expired" на просроченную presigned ссылку"""
+    return isinstance(err, S3UploadError) and err.status == 403 and "expired" in str(err.text).lower()
+
+
+def is_retryable(err: BaseException) -> bool:
+    if isinstance(err, S3UploadError):
+        return err.status in (408, 429) or err.status >= 500
+    return isinstance(err, (aiohttp.ClientError, TimeoutError))
+
+
+class RetryPolicy:
+    """
+    Повторы загрузки по presigned URL.
+
+    Временные ошибки (5xx, 429, обрыв соединения) повторяются с экспоненциальной
+    задержкой и full jitter, просроченная ссылка перед повтором подписывается заново.
+    Объекты до hedge_size байт можно грузить с хеджированием: если попытка не
+    закончилась за hedge_delay, параллельно стартует вторая, побеждает первая успешная.
+    Попытка получает URL и должна сама открыть поток заново.
+    """
+
+    def __init__(
+        self,
+        attempts: int = None,
+        base_delay: float = None,
+        max_delay: float = None,
+        hedge_size: int = None,
+        hedge_delay: float = None,
+        name: str = "upload",
+    ):
+        self.attempts = attempts or config.UPLOAD_RETRIES
+        self.base_delay = base_delay if base_delay is not None else config.UPLOAD_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else config.UPLOAD_RETRY_MAX_DELAY
+        self.hedge_size = hedge_size if hedge_size is not None else config.UPLOAD_HEDGE_MAX_SIZE
+        self.hedge_delay = hedge_delay if hedge_delay is not None else config.UPLOAD_HEDGE_DELAY
+        self._attempt_counts = metrics.histogram(f"{name}_attempts", ATTEMPT_BUCKETS)
+        self._refreshes = metrics.counter(f"{name}_url_refreshes")
+        self._hedges = metrics.counter(f"{name}_hedges")
+
+    def hedges(self, size: int = None) -> bool:
+        return bool(self.hedge_size) and size is not None and size <= self.hedge_size
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(
+        self,
+        upload: Callable[[str], Awaitable[T]],
+        url: str,
+        refresh: Callable[[], Awaitable[str]] = None,
+        size: int = None,
+    ) -> T:
+        hedge = self.hedges(size)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await (self._hedged(upload, url) if hedge else upload(url))
+            except Exception as err:
+                expired = refresh is not None and is_expired(err)
+                if attempt >= self.attempts or not (expired or is_retryable(err)):
+                    self._attempt_counts.observe(attempt)
+                    raise
+                logger.warning("Upload failed (attempt %d/%d): %s", attempt, self.attempts, err)
+                if expired:
+                    # Повтор со свежей ссылкой, ждать нечего
+                    self._refreshes.inc()
+                    url = await refresh()
+                else:
+                    await asyncio.sleep(self.backoff(attempt))
+                continue
+            self._attempt_counts.observe(attempt)
+            return result
+
+    async def _hedged(self, upload: Callable[[str], Awaitable[T]], url: str) -> T:
+        tasks = [asyncio.ensure_future(upload(url))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                self._hedges.inc()
+                tasks.append(asyncio.ensure_future(upload(url)))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Обе попытки упали - отдаём ошибку первой
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
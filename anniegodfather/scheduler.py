@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+from collections import defaultdict, deque
+from collections.abc import Awaitable, Callable
+
+from anniegodfather.cache import LRUCache
+from anniegodfather.jobs import MediaGroup, MediaJob
+from anniegodfather.journal import TransferJournal
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+from anniegodfather.throttle import TokenBucket
+
+Item = MediaJob | MediaGroup
+# Сколько token bucket пользователей держать в памяти
+MAX_TRACKED_USERS = 10_000
+
+
+def owner(item: Item) -> int:
+    return item.jobs[0].telegram_id if isinstance(item, MediaGroup) else item.telegram_id
+
+
+class FairQueue:
+    """
+    Очередь задач с отдельной очередью на каждого telegram_id и справедливой выдачей.
+
+    Пользователи обходятся по кругу (weighted round robin): пользователь с весом w
+    получает до w задач подряд, затем ход переходит к следующему. Пропускаются
+    пользователи, у которых уже выполняется max_per_user задач или закончились
+    токены в их token bucket частоты запусков. Альбом занимает столько мест из
+    max_per_user, сколько его файлов грузится одновременно. Общий размер очереди ограничен maxsize.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        max_per_user: int = None,
+        rate: float = None,
+        burst: int = None,
+        weights: dict[int, int] = None,
+    ):
+        self.maxsize = maxsize
+        self.max_per_user = max_per_user or config.USER_MAX_CONCURRENT
+        self.rate = rate if rate is not None else config.USER_JOB_RATE
+        self.burst = burst or config.USER_JOB_BURST
+        self.weights = weights if weights is not None else config.USER_WEIGHTS
+        self._queues: dict[int, deque[Item]] = {}
+        # Пользователи с задачами в очереди, текущий - первый
+        self._ring: deque[int] = deque()
+        self._credits: dict[int, int] = {}
+        self._running: dict[int, int] = defaultdict(int)
+        self._buckets = LRUCache(MAX_TRACKED_USERS)
+        self._size = 0
+        self._changed = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return self._size >= self.maxsize
+
+    def pending(self, user: int) -> int:
+        return len(self._queues.get(user, ()))
+
+    async def put(self, user: int, item: Item) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self.full())
+            queue = self._queues.get(user)
+            if queue is None:
+                queue = self._queues[user] = deque()
+                self._ring.append(user)
+                self._credits[user] = self.weights.get(user, 1)
+            queue.append(item)
+            self._size += 1
+            self._changed.notify_all()
+
+    async def get(self) -> tuple[int, Item]:
+        async with self._changed:
+            while True:
+                picked, wait = self._pick()
+                if picked is not None:
+                    # Освободилось место для ждущих put
+                    self._changed.notify_all()
+                    return picked
+                try:
+                    await asyncio.wait_for(self._changed.wait(), wait)
+                except TimeoutError:
+                    # Пополнились токены у кого-то из пользователей
+                    pass
+
+    def cost(self, item: Item) -> int:
+        """Сколько мест из max_per_user занимает задача"""
+        if isinstance(item, MediaGroup):
+            return min(len(item.jobs), self.max_per_user)
+        return 1
+
+    async def task_done(self, user: int, item: Item = None) -> None:
+        async with self._changed:
+            self._running[user] -= self.cost(item) if item is not None else 1
+            if not self._running[user]:
+                del self._running[user]
+            self._changed.notify_all()
+
+    def _bucket(self, user: int) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets.put(user, bucket)
+        return bucket
+
+    def _next(self, user: int) -> None:
+        self._ring.rotate(-1)
+        self._credits[user] = self.weights.get(user, 1)
+
+    def _pick(self) -> tuple[tuple[int, Item] | None, float | None]:
+        """Следующая задача по кругу и, если выдать нечего, сколько ждать токенов"""
+        wait = None
+        for _ in range(len(self._ring)):
+            user = self._ring[0]
+            queue = self._queues[user]
+            if self._running[user] + self.cost(queue[0]) > self.max_per_user:
+                self._next(user)
+                continue
+            bucket = self._bucket(user)
+            if not bucket.try_take():
+                delay = bucket.delay()
+                wait = delay if wait is None else min(wait, delay)
+                self._next(user)
+                continue
+
+            item = queue.popleft()
+            self._size -= 1
+            self._running[user] += self.cost(item)
+            self._credits[user] -= 1
+            if not queue:
+                self._ring.popleft()
+                del self._queues[user], self._credits[user]
+            elif self._credits[user] <= 0:
+                self._next(user)
+            return (user, item), None
+        return None, wait
+
+
+class TransferScheduler:
+    """
+    Очередь задач на перенос медиа с фиксированным пулом воркеров.
+
+    Хэндлер только ставит задачу в очередь и сразу отвечает пользователю.
+    Очередь ограничена: когда она заполнена, submit ждёт свободного места,
+    новых задач сверх пула воркеров не создаётся. Задачи разных пользователей
+    выдаются воркерам по очереди (FairQueue), поэтому сотня файлов от одного
+    не задерживает остальных. Если передан журнал, задача записывается в него
+    до постановки в очередь и переживает рестарт.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Item], Awaitable[None]],
+        workers: int = None,
+        queue_size: int = None,
+        journal: TransferJournal = None,
+    ):
+        self.runner = runner
+        self.journal = journal
+        self.workers = workers or config.TRANSFER_WORKERS
+        self.queue = FairQueue(queue_size or config.TRANSFER_QUEUE_SIZE)
+        self._ids = itertools.count(1)
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self.journal is not None:
+            # Номера задач продолжаются после рестарта
+            self._ids = itertools.count(await self.journal.last_job_id() + 1)
+        for number in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(number), name=f"transfer-worker-{number}"))
+        logger.info("Started %d transfer workers", self.workers)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    @property
+    def busy(self) -> bool:
+        return self.queue.full()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    async def submit(self, item: Item) -> int:
+        """Ставит задачу или альбом в очередь, при заполненной очереди ждёт. Возвращает номер задачи"""
+        jobs = item.jobs if isinstance(item, MediaGroup) else [item]
+        for job in jobs:
+            if job.job_id is None:
+                job.job_id = self.next_id()
+            if self.journal is not None:
+                await self.journal.add(job)
+        await self.queue.put(owner(item), item)
+        return item.job_id
+
+    async def resume(self) -> list[MediaJob]:
+        """Ставит в очередь задачи, не завершённые до рестарта, и возвращает их"""
+        if self.journal is None:
+            return []
+        await self.journal.prune()
+        jobs = await self.journal.unfinished()
+        if jobs:
+            logger.info("Resuming %d unfinished transfer jobs", len(jobs))
+        for job in jobs:
+            await self.queue.put(job.telegram_id, job)
+        return jobs
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            user, job = await self.queue.get()
+            try:
+                logger.debug("Worker %d took job #%d %s", number, job.job_id, job.file_name)
+                await self.runner(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error("Transfer job #%d %s failed: %s", job.job_id, job.file_name, err)
+            finally:
+                await self.queue.task_done(user, job)
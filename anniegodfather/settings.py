@@ -18,6 +18,75 @@ class AppConfig(BaseModel):
     API_HASH: str = None
     DAD_API_KEY: str = None
     REDIS_URL: str = None
+    ADMIN_IDS: list[int] = []
+    # AnnieDad client
+    # Адреса host:port или DNS имена dns:///host:port экземпляров AnnieDad
+    DAD_TARGETS: list[str] = ["127.0.0.1:8081"]
+    GRPC_LB_POLICY: str = "least_request"
+    GRPC_HEALTH_INTERVAL: float = 5
+    GRPC_HEALTH_TIMEOUT: float = 1
+    GRPC_CHANNEL_POOL_SIZE: int = 4
+    GRPC_MAX_STREAMS_PER_CHANNEL: int = 100
+    GRPC_MAX_MESSAGE_SIZE: int = 16 * 1024 * 1024
+    # Go сервер по умолчанию рвёт соединение, если ping чаще раза в 5 минут
+    GRPC_KEEPALIVE_TIME: float = 300
+    GRPC_KEEPALIVE_TIMEOUT: float = 20
+    GRPC_KEEPALIVE_WITHOUT_CALLS: bool = False
+    GRPC_COMPRESSION: str = None
+    PRESIGN_BATCHING: bool = False
+    PRESIGN_BATCH_WINDOW: float = 0.01
+    PRESIGN_BATCH_MAX_SIZE: int = 50
+    GET_URL_CACHE_SIZE: int = 10_000
+    GET_URL_CACHE_MARGIN: float = 60
+    TOKEN_BACKEND: str = "memory"
+    TOKEN_CACHE_SIZE: int = 100_000
+    TOKEN_PURGE_INTERVAL: float = 60
+    TOKEN_REFRESH_ENABLED: bool = True
+    TOKEN_REFRESH_LEAD: float = 30
+    TOKEN_REFRESH_JITTER: float = 15
+    TOKEN_REFRESH_CONCURRENCY: int = 8
+    TOKEN_REFRESH_IDLE_WINDOW: float = 15 * 60
+    # Media transfer
+    STREAM_UPLOADS: bool = True
+    STREAM_CHUNK_SIZE: int = 64 * 1024
+    STREAM_TIMEOUT: int = 600
+    # Лимиты полосы в байтах в секунду, 0 - без ограничения
+    BANDWIDTH_IN: int = 0
+    BANDWIDTH_OUT: int = 0
+    UPLOAD_CONN_LIMIT: int = 100
+    UPLOAD_CONN_LIMIT_PER_HOST: int = 20
+    UPLOAD_DNS_CACHE_TTL: int = 300
+    UPLOAD_KEEPALIVE_TIMEOUT: float = 30
+    UPLOAD_RETRIES: int = 4
+    UPLOAD_RETRY_BASE_DELAY: float = 0.5
+    UPLOAD_RETRY_MAX_DELAY: float = 20
+    UPLOAD_HEDGE_MAX_SIZE: int = 0
+    UPLOAD_HEDGE_DELAY: float = 2.0
+    MULTIPART_THRESHOLD: int = 64 * 1024 * 1024
+    MULTIPART_PART_SIZE: int = 16 * 1024 * 1024
+    MULTIPART_CONCURRENCY: int = 4
+    MULTIPART_PART_RETRIES: int = 3
+    TELETHON_CONNECTIONS: int = 4
+    TELETHON_CHUNK_SIZE: int = 512 * 1024
+    TRANSFER_WORKERS: int = 4
+    TRANSFER_QUEUE_SIZE: int = 100
+    USER_MAX_CONCURRENT: int = 2
+    USER_JOB_RATE: float = 2.0
+    USER_JOB_BURST: int = 20
+    USER_WEIGHTS: dict[int, int] = {}
+    ALBUM_WINDOW: float = 1.0
+    JOURNAL_DB_PATH: str = "journal.sqlite3"
+    DEDUP_BACKEND: str = "sqlite"
+    DEDUP_DB_PATH: str = "dedup.sqlite3"
+    DEDUP_CACHE_SIZE: int = 10_000
+    DEDUP_CONTENT_HASH: bool = True
+    SPOOL_MEMORY_THRESHOLD: int = 8 * 1024 * 1024
+    SPOOL_QUOTA: int = 2 * 1024 * 1024 * 1024
+    # Обработка фото перед загрузкой, нужен Pillow: pip install anniegodfather[preprocess]
+    PREPROCESS_MEDIA: bool = False
+    PREPROCESS_WORKERS: int = 2
+    PREPROCESS_QUEUE_SIZE: int = 8
+    THUMBNAIL_SIZE: int = 320
 
     @field_validator("LOG_LEVEL")
     def check_log_level(cls, value):
@@ -26,5 +95,43 @@ class AppConfig(BaseModel):
             raise ValueError("Invalid log level: %s. Available log levels: %s" % (value, log_levels))
         return value
 
+    @field_validator("TOKEN_BACKEND")
+    def check_token_backend(cls, value):
+        if value not in ("memory", "redis"):
+            raise ValueError("Invalid token backend: %s. Available: memory, redis" % value)
+        return value
+
+    @field_validator("GRPC_LB_POLICY")
+    def check_grpc_lb_policy(cls, value):
+        if value not in ("least_request", "round_robin"):
+            raise ValueError("Invalid gRPC load balancing policy: %s. Available: least_request, round_robin" % value)
+        return value
+
+    @field_validator("GRPC_COMPRESSION")
+    def check_grpc_compression(cls, value):
+        if value not in (None, "gzip", "deflate"):
+            raise ValueError("Invalid gRPC compression: %s. Available: gzip, deflate" % value)
+        return value
+
+    @field_validator("DEDUP_BACKEND")
+    def check_dedup_backend(cls, value):
+        if value not in ("memory", "sqlite", "redis"):
+            raise ValueError("Invalid dedup backend: %s. Available: memory, sqlite, redis" % value)
+        return value
+
+    @field_validator("MULTIPART_PART_SIZE")
+    def check_part_size(cls, value):
+        # S3 не принимает части меньше 5 MiB (кроме последней)
+        if value < 5 * 1024 * 1024:
+            raise ValueError("MULTIPART_PART_SIZE must be at least 5 MiB, got %s" % value)
+        return value
+
+    @field_validator("TELETHON_CHUNK_SIZE")
+    def check_telethon_chunk_size(cls, value):
+        # upload.getFile: limit кратен 4 KiB, 1 MiB делится на limit
+        if value % 4096 or (1024 * 1024) % value:
+            raise ValueError("TELETHON_CHUNK_SIZE must be a multiple of 4 KiB dividing 1 MiB, got %s" % value)
+        return value
+
 
 config = AppConfig(**settings.as_dict())
\ No newline at end of file
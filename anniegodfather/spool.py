@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import tempfile
+from collections.abc import AsyncIterator, Callable, Iterable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from anniegodfather.downloader import spool_to_disk
+from anniegodfather.jobs import BOT_API_DOWNLOAD_LIMIT
+from anniegodfather.logger import logger
+from anniegodfather.settings import config
+
+SPOOL_SUFFIX = ".spool"
+
+
+@dataclass
+class Spooled:
+    """Файл, полностью сохранённый в памяти (data) или на диске (path)"""
+
+    size: int
+    data: bytes = None
+    path: str = None
+
+
+class SpoolManager:
+    """
+    Промежуточное хранение файлов перед загрузкой в S3.
+
+    Файлы до memory_threshold держатся в памяти, большие сохраняются в SAVE_FOLDER,
+    а если он не задан - в каталог во временной папке системы. Каталог создаётся при первой записи.
+    Суммарный объём файлов на диске ограничен quota: новые передачи ждут, пока
+    место не освободится. Файл больше всей квоты пускается, только когда диск пуст.
+    """
+
+    def __init__(self, folder: str = None, memory_threshold: int = None, quota: int = None):
+        self.folder = folder or config.SAVE_FOLDER or os.path.join(tempfile.gettempdir(), "anniegodfather-spool")
+        self.memory_threshold = memory_threshold if memory_threshold is not None else config.SPOOL_MEMORY_THRESHOLD
+        self.quota = quota or config.SPOOL_QUOTA
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name + SPOOL_SUFFIX)
+
+    def cleanup(self, keep: Iterable[str] = ()) -> int:
+        """Удаляет spool файлы, оставшиеся после падения, кроме файлов незавершённых задач"""
+        if not os.path.isdir(self.folder):
+            return 0
+        keep = set(keep)
+        removed = 0
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(SPOOL_SUFFIX) and entry.path not in keep:
+                os.remove(entry.path)
+                removed += 1
+        if removed:
+            logger.info("Removed %d orphaned spool files from %s", removed, self.folder)
+        return removed
+
+    @asynccontextmanager
+    async def _reserve(self, size: int):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used == 0 or self.used + size <= self.quota)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.used -= size
+                self._changed.notify_all()
+
+    @asynccontextmanager
+    async def open(
+        self,
+        name: str,
+        stream_from: Callable[[int], AsyncIterator[bytes]],
+        size_hint: int = None,
+        downloaded: bool = False,
+        memory: bool = True,
+        scratch: int = 0,
+    ) -> AsyncIterator[Spooled]:
+        """
+        Сохраняет поток и отдаёт Spooled на время загрузки.
+
+        Частично скачанный до рестарта файл докачивается, полностью скачанный
+        (downloaded или уже size_hint байт на диске) используется как есть.
+        С memory=False файл всегда пишется на диск, например для обработки в другом
+        процессе, а scratch добавляет в квоту место под файлы, которые обработка создаёт рядом. После выхода файл удаляется, кроме
+        случая отмены задачи - тогда его докачают после рестарта.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(name)
+        existing = os.path.getsize(path) if os.path.exists(path) else 0
+        # Файл известного размера целиком на диске, поток с его конца открывать нельзя
+        complete = existing > 0 and (downloaded or (size_hint is not None and existing >= size_hint))
+
+        head = b""
+        stream = None
+        if not existing:
+            stream = stream_from(0)
+            if memory and (size_hint is None or size_hint <= self.memory_threshold):
+                head = await _read_up_to(stream, self.memory_threshold)
+                if len(head) <= self.memory_threshold:
+                    yield Spooled(len(head), data=head)
+                    return
+
+        # Без размера файл может прийти только через Bot API, а он отдаёт не больше 20 Мб
+        reserve = max(size_hint or BOT_API_DOWNLOAD_LIMIT, existing) + scratch
+        async with self._reserve(reserve):
+            try:
+                if not complete:
+                    if stream is None:
+                        logger.debug("Resuming spool of %s from byte %d", name, existing)
+                        stream = stream_from(existing)
+                    await spool_to_disk(_prepend(head, stream), path, append=existing > 0)
+                yield Spooled(os.path.getsize(path), path=path)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                _remove(path)
+                raise
+            _remove(path)
+
+
+async def _read_up_to(stream: AsyncIterator[bytes], limit: int) -> bytes:
+    """Читает поток, пока не закончится или не наберётся больше limit байт"""
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer += chunk
+        if len(buffer) > limit:
+            break
+    return bytes(buffer)
+
+
+async def _prepend(head: bytes, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    if head:
+        yield head
+    async for chunk in stream:
+        yield chunk
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
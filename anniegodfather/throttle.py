@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections.abc import AsyncIterable, AsyncIterator
+
+from anniegodfather.settings import config
+
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не больше capacity в запасе.
+
+    rate <= 0 означает отсутствие ограничения.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float = 1) -> float:
+        """Через сколько секунд в ведре наберётся amount токенов"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def set_rate(self, rate: float, capacity: float = None) -> None:
+        self._refill()
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def reserve(self, amount: float) -> float:
+        """Забирает amount токенов, уходя в долг, и возвращает, сколько ждать до его погашения"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def try_take(self, amount: float = 1) -> bool:
+        if self.unlimited:
+            return True
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class BandwidthLimiter:
+    """
+    Общий лимит полосы в байтах в секунду для всех передач в одну сторону.
+
+    Учёт идёт по чанкам: каждый чанк забирает свой размер из token bucket
+    в долг, а передача ждёт, пока долг не погасится. Лимит можно менять на ходу
+    через set_rate, 0 снимает ограничение.
+    """
+
+    def __init__(self, rate: int = 0):
+        # Запас на секунду передачи на полной скорости
+        self._bucket = TokenBucket(rate, rate)
+
+    @property
+    def rate(self) -> int:
+        return int(self._bucket.rate)
+
+    def set_rate(self, rate: int) -> None:
+        self._bucket.set_rate(rate, rate)
+
+    async def consume(self, amount: int) -> None:
+        delay = self._bucket.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+async def throttled(stream: AsyncIterable[bytes], limiter: BandwidthLimiter) -> AsyncIterator[bytes]:
+    async for chunk in stream:
+        await limiter.consume(len(chunk))
+        yield chunk
+
+
+inbound = BandwidthLimiter(config.BANDWIDTH_IN)
+outbound = BandwidthLimiter(config.BANDWIDTH_OUT)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import math
+import os
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Protocol
+
+import aiofiles
+import aiohttp
+
+from anniegodfather.exceptions import S3UploadError
+from anniegodfather.logger import logger
+from anniegodfather.retry import RetryPolicy
+from anniegodfather.settings import config
+from anniegodfather.throttle import outbound, throttled
+
+
+class S3Uploader:
+    """
+    Общий для приложения клиент загрузки по presigned URL.
+
+    Держит одну aiohttp сессию с пулом keep-alive соединений и кешем DNS,
+    чтобы не открывать новое TLS соединение к S3 на каждый файл. Методы put_*
+    делают одну попытку, повторы - через retry.run. Все тела запросов отдаются
+    чанками через общий лимит исходящей полосы.
+    """
+
+    def __init__(
+        self,
+        limit: int = None,
+        limit_per_host: int = None,
+        dns_cache_ttl: int = None,
+        keepalive_timeout: float = None,
+        retry: RetryPolicy = None,
+    ):
+        connector = aiohttp.TCPConnector(
+            limit=limit or config.UPLOAD_CONN_LIMIT,
+            limit_per_host=limit_per_host or config.UPLOAD_CONN_LIMIT_PER_HOST,
+            ttl_dns_cache=dns_cache_ttl or config.UPLOAD_DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=keepalive_timeout or config.UPLOAD_KEEPALIVE_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.retry = retry or RetryPolicy()
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    def multipart(self, presigner: "MultipartPresigner", part_size: int = None) -> "MultipartUploader":
+        return MultipartUploader(self.session, presigner, part_size=part_size)
+
+    async def put_stream(self, url: str, stream: AsyncIterator[bytes], size: int) -> None:
+        """Загружает поток по presigned URL без промежуточного файла"""
+        # Presigned PUT в S3 не принимает chunked transfer encoding,
+        # поэтому Content-Length выставляем явно
+        headers = {"Content-Length": str(size)}
+        async with self.session.put(url, data=throttled(stream, outbound), headers=headers) as resp:
+            if resp.status != 200:
+                raise S3UploadError(resp.status, await resp.text())
+
+    async def put_bytes(self, url: str, data: bytes) -> None:
+        """Загружает файл из памяти по presigned URL"""
+        await self.put_stream(url, iter_bytes(data), len(data))
+
+    async def put_file(self, url: str, file_location: str) -> None:
+        """Загружает файл с диска по presigned URL"""
+        await self.put_stream(url, iter_file(file_location), os.path.getsize(file_location))
+
+
+async def iter_bytes(data: bytes, chunk_size: int = None) -> AsyncIterator[memoryview]:
+    """Отдаёт буфер чанками без копирования"""
+    chunk_size = chunk_size or config.STREAM_CHUNK_SIZE
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+async def iter_file(file_location: str, chunk_size: int = None) -> AsyncIterator[bytes]:
+    chunk_size = chunk_size or config.STREAM_CHUNK_SIZE
+    async with aiofiles.open(file_location, "rb") as f:
+        while chunk := await f.read(chunk_size):
+            yield chunk
+
+
+async def iter_parts(stream: AsyncIterator[bytes], part_size: int) -> AsyncIterator[bytes]:
+    """Нарезает поток произвольных чанков на части ровно по part_size байт (последняя - остаток)"""
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+@dataclass
+class MultipartState:
+    """Состояние multipart загрузки, которое нужно сохранить для докачки после рестарта"""
+
+    part_size: int
+    upload_id: str = None
+    etags: dict[int, str] = field(default_factory=dict)
+
+    def first_missing(self, parts_count: int) -> int:
+        """Номер первой незагруженной части, parts_count + 1 если загружены все"""
+        return next((n for n in range(1, parts_count + 1) if n not in self.etags), parts_count + 1)
+
+
+class MultipartPresigner(Protocol):
+    """Источник presigned URL для multipart загрузки. Реализуется DadClient"""
+
+    async def create_multipart_upload(self, filename: str, parts: int, telegram_id: int = None) -> tuple[str, list[str]]: ...
+
+    async def presign_upload_parts(
+        self, filename: str, upload_id: str, part_numbers: list[int], telegram_id: int = None
+    ) -> list[str]: ...
+
+    async def complete_multipart_upload(
+        self, filename: str, upload_id: str, etags: list[str], telegram_id: int = None
+    ) -> None: ...
+
+    async def abort_multipart_upload(self, filename: str, upload_id: str, telegram_id: int = None) -> None: ...
+
+
+class MultipartUploader:
+    """
+    Параллельная multipart загрузка в S3.
+
+    Части читаются из потока по очереди, одновременно в памяти и в сети находится
+    не больше `concurrency` частей. Каждая часть ретраится отдельно, просроченная
+    ссылка на часть подписывается заново. При ошибке
+    загрузка отменяется через AbortMultipartUpload. Если передан MultipartState
+    уже начатой загрузки, поток должен начинаться с resume_offset, а готовые части
+    пропускаются.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        presigner: MultipartPresigner,
+        part_size: int = None,
+        concurrency: int = None,
+        retries: int = None,
+    ):
+        self.session = session
+        self.presigner = presigner
+        self.part_size = part_size or config.MULTIPART_PART_SIZE
+        self.concurrency = concurrency or config.MULTIPART_CONCURRENCY
+        self.retry = RetryPolicy(attempts=retries or config.MULTIPART_PART_RETRIES, hedge_size=0, name="multipart_part")
+
+    def resume_offset(self, state: MultipartState, size: int) -> int:
+        """С какого байта нужно открыть поток, чтобы продолжить загрузку"""
+        parts_count = max(1, math.ceil(size / state.part_size))
+        return min(size, (state.first_missing(parts_count) - 1) * state.part_size)
+
+    async def upload(
+        self,
+        file_name: str,
+        stream: AsyncIterator[bytes],
+        size: int,
+        telegram_id: int = None,
+        state: MultipartState = None,
+        on_part: Callable[[MultipartState], Awaitable[None]] = None,
+    ) -> None:
+        state = state or MultipartState(self.part_size)
+        parts_count = max(1, math.ceil(size / state.part_size))
+        if state.upload_id is None:
+            state.upload_id, urls = await self.presigner.create_multipart_upload(
+                file_name, parts_count, telegram_id=telegram_id
+            )
+            urls = dict(enumerate(urls, start=1))
+            logger.info("Started multipart upload %s for %s, %d parts", state.upload_id, file_name, parts_count)
+            if on_part is not None:
+                await on_part(state)
+        else:
+            # Старые presigned URL могли истечь, подписываем оставшиеся части заново
+            missing = [n for n in range(1, parts_count + 1) if n not in state.etags]
+            urls = {}
+            if missing:
+                fresh = await self.presigner.presign_upload_parts(
+                    file_name, state.upload_id, missing, telegram_id=telegram_id
+                )
+                urls = dict(zip(missing, fresh))
+            logger.info("Resuming multipart upload %s for %s, %d parts left", state.upload_id, file_name, len(missing))
+
+        try:
+            async def refresh(number: int) -> str:
+                [url] = await self.presigner.presign_upload_parts(
+                    file_name, state.upload_id, [number], telegram_id=telegram_id
+                )
+                return url
+
+            await self._upload_parts(urls, stream, state, parts_count, on_part, refresh)
+            etags = [state.etags[n] for n in range(1, parts_count + 1)]
+            await self.presigner.complete_multipart_upload(file_name, state.upload_id, etags, telegram_id=telegram_id)
+        except Exception:
+            # При отмене (остановка бота) загрузку не трогаем, её продолжат после рестарта
+            try:
+                await self.presigner.abort_multipart_upload(file_name, state.upload_id, telegram_id=telegram_id)
+            except Exception as err:
+                logger.error("Failed to abort multipart upload %s: %s", state.upload_id, err)
+            raise
+
+    async def _upload_parts(
+        self,
+        urls: dict[int, str],
+        stream: AsyncIterator[bytes],
+        state: MultipartState,
+        parts_count: int,
+        on_part: Callable[[MultipartState], Awaitable[None]] = None,
+        refresh: Callable[[int], Awaitable[str]] = None,
+    ) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send(number: int, data: bytes):
+            try:
+                state.etags[number] = await self.retry.run(
+                    partial(self._put_part, data=data),
+                    urls[number],
+                    refresh=partial(refresh, number) if refresh is not None else None,
+                    size=len(data),
+                )
+            finally:
+                slots.release()
+            if on_part is not None:
+                await on_part(state)
+
+        number = state.first_missing(parts_count) - 1
+        try:
+            async with asyncio.TaskGroup() as tg:
+                async for data in iter_parts(stream, state.part_size):
+                    number += 1
+                    if number > parts_count:
+                        raise S3UploadError(400, "stream is longer than declared size")
+                    if number in state.etags:
+                        # Часть уже загружена до рестарта
+                        continue
+                    # Не читаем следующую часть, пока не освободится слот
+                    await slots.acquire()
+                    tg.create_task(send(number, data))
+        except BaseExceptionGroup as group:
+            # Наружу отдаём первую ошибку, а не группу
+            raise group.exceptions[0]
+
+        if len(state.etags) != parts_count:
+            raise S3UploadError(400, "stream is shorter than declared size")
+
+    async def _put_part(self, url: str, data: bytes) -> str:
+        headers = {"Content-Length": str(len(data))}
+        async with self.session.put(url, data=throttled(iter_bytes(data), outbound), headers=headers) as resp:
+            if resp.status != 200:
+                raise S3UploadError(resp.status, await resp.text())
+            return resp.headers["ETag"]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Общее для бенчмарков: пути импорта как у приложения и загрузка модуля из другой ревизии git"""
+import importlib.util
+import os
+import subprocess
+import sys
+from pathlib import Path
+from types import ModuleType
+
+ROOT = Path(__file__).resolve().parent.parent
+# logger.py импортирует settings напрямую, как при запуске из каталога пакета
+sys.path[:0] = [str(ROOT), str(ROOT / "anniegodfather")]
+os.environ.setdefault("GODFATHER_TELEGRAM_TOKEN", "1:bench")
+
+
+def load_revision(revision: str, module: str) -> ModuleType:
+    """Модуль пакета в том виде, в каком он был в revision. Остальные модули берутся из текущего дерева"""
+    path = module.replace(".", "/") + ".py"
+    source = subprocess.run(
+        ["git", "show", f"{revision}:{path}"], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    spec = importlib.util.spec_from_loader(f"{module}@{revision}", loader=None)
+    loaded = importlib.util.module_from_spec(spec)
+    exec(compile(source, f"{revision}:{path}", "exec"), loaded.__dict__)
+    return loaded
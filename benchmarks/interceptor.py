@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Накладные расходы interceptor на один вызов DadClient в микросекундах.
+
+Вызывается только intercept_unary_unary с пустым continuation, токен пользователя
+уже в хранилище. Сравнение с ревизией, где API ключ добавлял отдельный
+AddApiKeyInterceptor:
+
+    python -m benchmarks.interceptor --baseline 6c7a181
+"""
+import argparse
+import asyncio
+import time
+from types import ModuleType
+
+from grpc.aio import ClientCallDetails, Metadata
+
+from benchmarks.common import load_revision
+from anniegodfather import auth
+from tests.fakes import make_jwt
+
+USER = 1
+METHOD = b"/main.Media/PostURL"
+
+
+async def _continuation(details, request):
+    return details
+
+
+async def chain(module: ModuleType):
+    """Цепочка interceptors из module в порядке, в котором их ставил DadClient"""
+    interceptor = module.AuthInterceptor("127.0.0.1:1", "key")
+    interceptor.refresher = None
+    await interceptor.token_storage.upsert_tokens(USER, make_jwt(USER, 3600), make_jwt(USER, 86400))
+    module.current_user.set(USER)
+
+    async def call(details):
+        return await interceptor.intercept_unary_unary(_continuation, details, None)
+
+    if hasattr(module, "AddApiKeyInterceptor"):
+        api_key = module.AddApiKeyInterceptor("key")
+        inner = call
+
+        async def call(details):
+            return await api_key.intercept_unary_unary(lambda d, request: inner(d), details, None)
+
+    return call
+
+
+async def main(args: argparse.Namespace) -> None:
+    candidates = {"current": auth}
+    if args.baseline:
+        candidates[args.baseline] = load_revision(args.baseline, "anniegodfather.auth")
+    details = ClientCallDetails(METHOD, None, Metadata(), None, None)
+    for name, module in candidates.items():
+        call = await chain(module)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            for _ in range(args.number):
+                await call(details)
+            best = min(best, (time.perf_counter() - started) / args.number)
+        print(f"{name:>10}: {best * 1e6:.2f} us/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="git ревизия для сравнения")
+    asyncio.run(main(parser.parse_args()))
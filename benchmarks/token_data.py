@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Стоимость TokenData.safe_update (access + refresh) и память на запись.
+
+Память считается через tracemalloc по объектам TokenData, строки токенов общие.
+Сравнение с ревизией до slots и разбора exp без библиотеки jwt:
+
+    python -m benchmarks.token_data --baseline 5a292f4
+"""
+import argparse
+import sys
+import timeit
+import tracemalloc
+
+from benchmarks.common import load_revision
+from anniegodfather import auth
+from tests.fakes import make_jwt
+
+
+def upsert_cost(token_data: type, access: str, refresh: str, number: int) -> float:
+    data = token_data()
+    return timeit.timeit(lambda: data.safe_update(access_token=access, refresh_token=refresh), number=number) / number
+
+
+def bytes_per_entry(token_data: type, access: str, refresh: str, number: int) -> float:
+    tracemalloc.start()
+    entries = [token_data().safe_update(access_token=access, refresh_token=refresh) for _ in range(number)]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated / len(entries)
+
+
+def object_size(token_data: type) -> int:
+    data = token_data()
+    return sys.getsizeof(data) + (sys.getsizeof(data.__dict__) if hasattr(data, "__dict__") else 0)
+
+
+def main(args: argparse.Namespace) -> None:
+    access, refresh = make_jwt(1, 3600), make_jwt(1, 86400)
+    candidates = {"current": auth.TokenData}
+    if args.baseline:
+        candidates[args.baseline] = load_revision(args.baseline, "anniegodfather.auth").TokenData
+    for name, token_data in candidates.items():
+        cost = min(upsert_cost(token_data, access, refresh, args.number) for _ in range(args.repeat))
+        memory = bytes_per_entry(token_data, access, refresh, args.number)
+        print(
+            f"{name:>10}: {cost * 1e6:6.1f} us/upsert  {memory:5.0f} B/entry  "
+            f"object{'' if hasattr(token_data(), '__slots__') else '+__dict__'} {object_size(token_data)} B"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="git ревизия для сравнения")
+    main(parser.parse_args())
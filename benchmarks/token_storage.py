@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность TokenInMemoryStorage при 10k+ одновременных пользователях.
+
+Каждый пользователь - отдельная задача, делает ops чтений и записей в доле writes.
+Режим interleaved добавляет sleep(0) после каждой операции, как при реальном
+переключении задач. Сравнение с ревизией до lock-free чтений:
+
+    python -m benchmarks.token_storage --baseline 70f063b
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import load_revision
+from anniegodfather import auth
+from tests.fakes import make_jwt
+
+
+async def run(storage_cls: type, users: int, ops: int, writes: float, interleaved: bool) -> float:
+    tokens = [(make_jwt(user, 3600), make_jwt(user, 86400)) for user in range(users)]
+    storage = storage_cls()
+    for user in range(users):
+        await storage.upsert_tokens(user, *tokens[user])
+
+    async def client(user: int) -> None:
+        for _ in range(ops):
+            if random.random() < writes:
+                await storage.upsert_tokens(user, *tokens[user])
+            else:
+                await storage.get_tokens(user)
+            if interleaved:
+                await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(user) for user in range(users)))
+    return users * ops / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    candidates = {"current": auth.TokenInMemoryStorage}
+    if args.baseline:
+        candidates[args.baseline] = load_revision(args.baseline, "anniegodfather.auth").TokenInMemoryStorage
+    for interleaved in (False, True):
+        print("with sleep(0) per op" if interleaved else "back-to-back")
+        for writes in (0.0, 0.01, 0.1):
+            line = [f"  writes {writes:>4.0%}:"]
+            for name, storage_cls in candidates.items():
+                best = max([await run(storage_cls, args.users, args.ops, writes, interleaved) for _ in range(args.repeat)])
+                line.append(f"{name} {best:>10,.0f} ops/s")
+            print("  ".join(line))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", help="git ревизия для сравнения")
+    asyncio.run(main(parser.parse_args()))
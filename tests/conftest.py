@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+import os
+
+# settings читаются при импорте anniegodfather, токен бота обязателен
+os.environ.setdefault("GODFATHER_TELEGRAM_TOKEN", "1:test")
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Fake AnnieDad на сгенерированных servicer для тестов клиента и fake S3 для тестов загрузки"""
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+
+import grpc
+from aiohttp import web
+from grpc import aio
+
+from anniegodfather.jobs import MediaJob
+from anniegodfather.proto import anniedad_pb2, anniedad_pb2_grpc, auth_pb2, auth_pb2_grpc
+
+
+def make_jwt(sub: int, ttl: float) -> str:
+    """Токен без подписи, клиент читает из него только exp"""
+
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    payload = {"sub": sub, "exp": int(time.time() + ttl), "nonce": random.random()}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(payload)}.c2ln"
+
+
+def subject(token: str) -> int:
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"]
+
+
+class FakeAuth(auth_pb2_grpc.AuthServiceServicer):
+    """
+    AuthService с ротацией refresh токена: каждый refresh токен действует один раз.
+
+    Пользователи из unknown отвечают NOT_FOUND, повторное использование refresh
+    токена считается в reused и отвечает INVALID_ARGUMENT.
+    """
+
+    def __init__(self, delay: float = 0.01, unknown: frozenset[int] = frozenset()):
+        self.delay = delay
+        self.unknown = unknown
+        self.logins: dict[int, int] = {}
+        self.refreshes: dict[int, int] = {}
+        self.valid: dict[int, str] = {}
+        self.reused = 0
+
+    def _issue(self, user: int) -> auth_pb2.AuthResponse:
+        self.valid[user] = make_jwt(user, 86400)
+        return auth_pb2.AuthResponse(access_token=make_jwt(user, 3600), refresh_token=self.valid[user])
+
+    async def LoginTelegram(self, request, context):
+        user = request.telegram_id
+        self.logins[user] = self.logins.get(user, 0) + 1
+        await asyncio.sleep(self.delay)
+        if user in self.unknown:
+            await context.abort(grpc.StatusCode.NOT_FOUND, "user not found")
+        return self._issue(user)
+
+    async def RefreshToken(self, request, context):
+        user = subject(request.refresh_token)
+        self.refreshes[user] = self.refreshes.get(user, 0) + 1
+        await asyncio.sleep(self.delay)
+        if self.valid.get(user) != request.refresh_token:
+            self.reused += 1
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, "refresh token reused")
+        return self._issue(user)
+
+
+class EchoMedia(anniedad_pb2_grpc.MediaServicer):
+    """Отвечает ссылкой "<sub из authorization>|<filename>", чтобы было видно, чей токен пришёл"""
+
+    async def _owner(self, context) -> int:
+        # Небольшая случайная задержка перемешивает ответы одновременных вызовов
+        await asyncio.sleep(random.random() * 0.005)
+        return subject(dict(context.invocation_metadata())["authorization"])
+
+    async def PostURL(self, request, context):
+        return anniedad_pb2.PostMediaResponse(url=f"{await self._owner(context)}|{request.filename}")
+
+    async def GetURL(self, request, context):
+        return anniedad_pb2.GetMediaResponse(url=f"{await self._owner(context)}|{request.filename}")
+
+
+async def serve(auth: FakeAuth = None, media: anniedad_pb2_grpc.MediaServicer = None) -> tuple[aio.Server, str]:
+    """Запускает fake AnnieDad на свободном порту, возвращает сервер и его адрес"""
+    server = aio.server()
+    auth_pb2_grpc.add_AuthServiceServicer_to_server(auth or FakeAuth(), server)
+    anniedad_pb2_grpc.add_MediaServicer_to_server(media or EchoMedia(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    return server, f"127.0.0.1:{port}"
+
+
+class FakeS3:
+    """
+    S3 за presigned ссылками: PUT объектов и частей multipart загрузки.
+
+    В fail можно положить ответы (status, text), которые вернут ближайшие PUT
+    по ключу или номеру части. Ссылка с expired=1 отвечает как просроченная.
+    """
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+        self.parts: dict[str, dict[int, bytes]] = {}
+        self.fail: dict[str | int, list[tuple[int, str]]] = {}
+        self.puts: list[str | int] = []
+        self.base_url: str = None
+        self._runner: web.AppRunner = None
+
+    async def start(self) -> "FakeS3":
+        app = web.Application()
+        app.router.add_put("/{key}", self._put)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        return self
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    def url(self, key: str, upload_id: str = None, part: int = None, expired: bool = False) -> str:
+        url = f"{self.base_url}/{key}"
+        if upload_id is not None:
+            url += f"?uploadId={upload_id}&partNumber={part}" + ("&expired=1" if expired else "")
+        return url
+
+    async def _put(self, request: web.Request) -> web.Response:
+        key = request.match_info["key"]
+        part = int(request.query["partNumber"]) if "partNumber" in request.query else None
+        body = await request.read()
+        self.puts.append(key if part is None else part)
+        if self.fail.get(part or key):
+            status, text = self.fail[part or key].pop(0)
+            return web.Response(status=status, text=text)
+        if request.query.get("expired"):
+            return web.Response(status=403, text="AccessDenied: Request has expired")
+        if part is None:
+            self.objects[key] = body
+            return web.Response()
+        self.parts.setdefault(request.query["uploadId"], {})[part] = body
+        return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+
+class FakePresigner:
+    """
+    Подпись ссылок вместо DadClient: одиночные PUT и multipart загрузки в FakeS3.
+
+    Части из expired получают при создании загрузки просроченные ссылки. С multipart=False
+    создание загрузки отвечает UNIMPLEMENTED, как anniedad без multipart.
+    """
+
+    def __init__(self, s3: FakeS3, expired: frozenset[int] = frozenset(), multipart: bool = True):
+        self.s3 = s3
+        self.expired = expired
+        self.multipart = multipart
+        self.created: list[str] = []
+        self.uploads: dict[str, str] = {}
+        self.completed: list[str] = []
+        self.aborted: list[str] = []
+        self.presigned: list[int] = []
+
+    async def fetch_post_url(self, filename: str, telegram_id: int = None) -> str:
+        return self.s3.url(filename)
+
+    async def create_multipart_upload(self, filename: str, parts: int, telegram_id: int = None) -> tuple[str, list[str]]:
+        self.created.append(filename)
+        if not self.multipart:
+            raise aio.AioRpcError(grpc.StatusCode.UNIMPLEMENTED, aio.Metadata(), aio.Metadata(), "unknown method")
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = filename
+        urls = [self.s3.url(filename, upload_id, n, expired=n in self.expired) for n in range(1, parts + 1)]
+        return upload_id, urls
+
+    async def presign_upload_parts(
+        self, filename: str, upload_id: str, part_numbers: list[int], telegram_id: int = None
+    ) -> list[str]:
+        self.presigned += part_numbers
+        return [self.s3.url(filename, upload_id, n) for n in part_numbers]
+
+    async def complete_multipart_upload(
+        self, filename: str, upload_id: str, etags: list[str], telegram_id: int = None
+    ) -> None:
+        parts = self.s3.parts.pop(upload_id)
+        assert etags == [f'"{hashlib.md5(parts[n]).hexdigest()}"' for n in sorted(parts)]
+        self.s3.objects[filename] = b"".join(parts[n] for n in sorted(parts))
+        self.completed.append(upload_id)
+
+    async def abort_multipart_upload(self, filename: str, upload_id: str, telegram_id: int = None) -> None:
+        self.s3.parts.pop(upload_id, None)
+        self.aborted.append(upload_id)
+
+
+class FakeSource:
+    """Замена MediaPipeline.open_source, которая помнит, с каких байт открывали файл. Открытие на конце файла - 416"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offsets: list[int] = []
+
+    async def __call__(self, job: MediaJob):
+        job.file_size = len(self.data)
+        return self.open
+
+    async def open(self, offset: int = 0):
+        self.offsets.append(offset)
+        if offset >= len(self.data):
+            raise RuntimeError("416 Requested Range Not Satisfiable")
+        for start in range(offset, len(self.data), 65536):
+            yield self.data[start : start + 65536]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from anniegodfather.channels import ChannelManager
+from anniegodfather.clients import DadClient
+from tests.fakes import FakeAuth, serve
+
+
+def test_dns_targets_share_health_and_close_dropped_pools():
+    async def main():
+        auth = FakeAuth(delay=0.1)
+        (first, a), (second, b) = await serve(auth), await serve(auth)
+        manager = ChannelManager()
+        dad = DadClient("dns:///anniedad:50051", "key", channels=manager, batching=False)
+        dad.get_url_cache = None
+
+        # Балансировщики auth и AnnieDad делят один цикл проверок
+        (health,) = manager._health.values()
+        assert {balancer.health for balancer in manager._balancers.values()} == {health}
+        await health.close()
+
+        await health._update([a, b])
+        # Вызов успевает взять канал, пока идёт login, и должен доработать после выпадения адреса
+        pending = asyncio.gather(*(dad.fetch_post_url("f", telegram_id=user) for user in range(4)))
+        await asyncio.sleep(0.02)
+        await health._update([a])
+        assert {key[0] for key in manager._pools} == {a}
+        assert await asyncio.wait_for(pending, 5) == [f"{user}|f" for user in range(4)]
+
+        await health._update([a, b])
+        assert await dad.fetch_post_url("g", telegram_id=1) == "1|g"
+        assert {key[0] for key in manager._pools} == {a, b}
+
+        await dad.close()
+        await first.stop(None)
+        await second.stop(None)
+
+    asyncio.run(main())
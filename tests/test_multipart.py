@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+
+import aiohttp
+import pytest
+
+from anniegodfather.exceptions import S3UploadError
+from anniegodfather.jobs import MediaJob
+from anniegodfather.pipeline import MediaPipeline
+from anniegodfather.settings import config
+from anniegodfather.uploader import MultipartState, MultipartUploader, S3Uploader
+from tests.fakes import FakePresigner, FakeS3, FakeSource
+
+PART_SIZE = 64 * 1024
+# Пять полных частей и неполная шестая
+DATA = os.urandom(PART_SIZE * 5 + 1000)
+
+
+async def _chunks(data: bytes, size: int = 10_000):
+    """Поток чанками, не совпадающими с границами частей"""
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+def _uploader(session, presigner, concurrency: int = 2) -> MultipartUploader:
+    uploader = MultipartUploader(session, presigner, part_size=PART_SIZE, concurrency=concurrency, retries=3)
+    uploader.retry.base_delay = 0
+    return uploader
+
+
+def test_parts_are_uploaded_and_completed():
+    async def main():
+        s3 = await FakeS3().start()
+        # Вторая часть получает просроченную ссылку, четвёртая один раз отвечает 503
+        presigner = FakePresigner(s3, expired=frozenset({2}))
+        s3.fail[4] = [(503, "Slow Down")]
+        saved = []
+
+        async def on_part(state: MultipartState):
+            saved.append(dict(state.etags))
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                await _uploader(session, presigner).upload("big.bin", _chunks(DATA), len(DATA), on_part=on_part)
+        finally:
+            await s3.stop()
+
+        assert s3.objects["big.bin"] == DATA
+        assert presigner.completed == ["upload-1"] and presigner.aborted == []
+        assert presigner.presigned == [2]
+        assert sorted(s3.puts) == [1, 2, 2, 3, 4, 4, 5, 6]
+        # Первое сохранение - сразу после создания загрузки, затем по одному на часть
+        assert len(saved) == 7 and saved[0] == {} and len(saved[-1]) == 6
+
+    asyncio.run(main())
+
+
+def test_failed_part_aborts_upload():
+    async def main():
+        s3 = await FakeS3().start()
+        presigner = FakePresigner(s3)
+        s3.fail[3] = [(400, "InvalidPart")]
+        try:
+            async with aiohttp.ClientSession() as session:
+                with pytest.raises(S3UploadError) as err:
+                    await _uploader(session, presigner).upload("big.bin", _chunks(DATA), len(DATA))
+        finally:
+            await s3.stop()
+
+        assert err.value.status == 400
+        assert presigner.aborted == ["upload-1"] and presigner.completed == []
+        assert "big.bin" not in s3.objects and s3.parts == {}
+
+    asyncio.run(main())
+
+
+def test_upload_resumes_from_saved_state():
+    async def main():
+        s3 = await FakeS3().start()
+        presigner = FakePresigner(s3)
+        state = MultipartState(PART_SIZE)
+        try:
+            async with aiohttp.ClientSession() as session:
+                uploader = _uploader(session, presigner, concurrency=1)
+
+                # Рестарт бота после двух загруженных частей
+                async def on_part(state: MultipartState):
+                    if len(state.etags) == 2:
+                        task.cancel()
+
+                upload = uploader.upload("big.bin", _chunks(DATA), len(DATA), state=state, on_part=on_part)
+                task = asyncio.create_task(upload)
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                assert sorted(state.etags) == [1, 2] and presigner.aborted == []
+
+                offset = uploader.resume_offset(state, len(DATA))
+                assert offset == 2 * PART_SIZE
+                s3.puts.clear()
+                await uploader.upload("big.bin", _chunks(DATA[offset:]), len(DATA), state=state)
+        finally:
+            await s3.stop()
+
+        assert s3.objects["big.bin"] == DATA
+        assert sorted(s3.puts) == [3, 4, 5, 6]
+        # Ссылки на оставшиеся части подписаны заново одним вызовом
+        assert presigner.presigned == [3, 4, 5, 6]
+        assert presigner.completed == ["upload-1"]
+
+    asyncio.run(main())
+
+
+def test_large_file_falls_back_to_single_put_without_multipart(monkeypatch):
+    async def main():
+        s3 = await FakeS3().start()
+        presigner = FakePresigner(s3, multipart=False)
+        uploader = S3Uploader()
+        pipeline = MediaPipeline(None, presigner, None, None, uploader)
+        try:
+            for job_id, name in enumerate(["first.mkv", "second.mkv"], start=1):
+                pipeline.open_source = FakeSource(DATA)
+                await pipeline.transfer(MediaJob(1, job_id, 7, "file-id", name, len(DATA), "video", job_id=job_id))
+        finally:
+            await uploader.close()
+            await s3.stop()
+
+        assert s3.objects == {"first.mkv": DATA, "second.mkv": DATA}
+        assert pipeline.multipart_supported is False
+        # Второй файл уже не пробует multipart
+        assert presigner.created == ["first.mkv"]
+
+    monkeypatch.setattr(config, "MULTIPART_THRESHOLD", PART_SIZE)
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import os
+
+import pytest
+
+from anniegodfather.jobs import MediaJob
+from anniegodfather.journal import JobState, TransferJournal
+from anniegodfather.pipeline import MediaPipeline, spool_name
+from anniegodfather.preprocess import AVAILABLE, MediaPreprocessor
+from anniegodfather.retry import RetryPolicy
+from anniegodfather.spool import SpoolManager
+from anniegodfather.uploader import S3Uploader
+from tests.fakes import FakePresigner, FakeS3, FakeSource
+
+DATA = os.urandom(300_000)
+
+
+async def _resume(
+    tmp_path, state: JobState, spooled: int, data: bytes = DATA, file_name: str = "video.mp4", preprocessor=None
+) -> tuple[FakeSource, FakeS3, JobState, bool]:
+    """Задача упала в state с первыми spooled байтами файла на диске и запускается заново"""
+    s3 = await FakeS3().start()
+    journal = TransferJournal(str(tmp_path / "journal.db"))
+    spool = SpoolManager(str(tmp_path / "spool"), memory_threshold=0)
+    # Хеджирование отправляет малые файлы через спул, а не потоком
+    uploader = S3Uploader(retry=RetryPolicy(hedge_size=len(data), hedge_delay=60))
+    pipeline = MediaPipeline(
+        None, FakePresigner(s3), None, None, uploader, journal=journal, spool=spool, preprocessor=preprocessor
+    )
+    pipeline.open_source = source = FakeSource(data)
+
+    kind = "document" if preprocessor is not None else "video"
+    job = MediaJob(1, 1, 7, "file-id", file_name, len(data), kind, job_id=1)
+    await journal.add(job)
+    await journal.set_state(job.job_id, state)
+    os.makedirs(spool.folder)
+    with open(spool.path(spool_name(job)), "wb") as f:
+        f.write(data[:spooled])
+
+    try:
+        await pipeline.transfer(job)
+        return source, s3, await journal.get_state(job.job_id), os.path.exists(spool.path(spool_name(job)))
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+        await uploader.close()
+        await journal.close()
+        await s3.stop()
+
+
+@pytest.mark.parametrize("state", [JobState.DOWNLOADED, JobState.UPLOADING])
+def test_downloaded_spool_is_uploaded_without_reopening_source(tmp_path, state):
+    source, s3, final, left = asyncio.run(_resume(tmp_path, state, len(DATA)))
+    assert source.offsets == []
+    assert s3.objects["video.mp4"] == DATA
+    assert final == JobState.DONE
+    assert not left
+
+
+def test_partial_spool_is_resumed_from_last_byte(tmp_path):
+    source, s3, final, left = asyncio.run(_resume(tmp_path, JobState.DOWNLOADING, 100_000))
+    assert source.offsets == [100_000]
+    assert s3.objects["video.mp4"] == DATA
+    assert final == JobState.DONE
+    assert not left
+
+
+def test_complete_spool_is_not_reopened_with_stale_state(tmp_path):
+    # Состояние не успело смениться на DOWNLOADED, но весь файл уже на диске
+    source, s3, final, left = asyncio.run(_resume(tmp_path, JobState.DOWNLOADING, len(DATA)))
+    assert source.offsets == []
+    assert s3.objects["video.mp4"] == DATA
+    assert final == JobState.DONE
+    assert not left
+
+
+def _photo_with_exif() -> bytes:
+    from PIL import Image
+
+    image = Image.effect_noise((640, 480), 64).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: повернуть на 90 градусов
+    exif[0x010F] = "Camera"
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.mark.skipif(not AVAILABLE, reason="нужен Pillow")
+@pytest.mark.parametrize("state, spooled", [(JobState.UPLOADING, 1.0), (JobState.DOWNLOADING, 0.5)])
+def test_preprocessed_photo_resumes_from_untouched_original(tmp_path, state, spooled):
+    from PIL import Image
+
+    photo = _photo_with_exif()
+    preprocessor = MediaPreprocessor(workers=1)
+    source, s3, final, left = asyncio.run(
+        _resume(tmp_path, state, int(len(photo) * spooled), photo, "photo.jpg", preprocessor)
+    )
+    assert source.offsets == ([] if spooled == 1.0 else [int(len(photo) * spooled)])
+    assert final == JobState.DONE
+    assert not left
+    assert os.listdir(tmp_path / "spool") == []
+    with Image.open(io.BytesIO(s3.objects["photo.jpg"])) as uploaded:
+        # Загружена повёрнутая копия без EXIF целиком, а не оригинал с чужим хвостом
+        uploaded.load()
+        assert uploaded.size == (480, 640)
+        assert not uploaded.getexif()
+    assert "photo_thumb.jpg" in s3.objects
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from anniegodfather.auth import TokenRefreshScheduler
+from anniegodfather.cache import SingleFlight
+from anniegodfather.clients import DadClient
+from anniegodfather.exceptions import AuthLoginUserNotFoundError
+from tests.fakes import FakeAuth, make_jwt, serve
+
+UNKNOWN_USER = 1001
+
+
+async def _client(auth: FakeAuth):
+    server, target = await serve(auth)
+    dad = DadClient(target, "key", batching=False)
+    dad.get_url_cache = None
+    return server, dad
+
+
+def test_concurrent_calls_share_one_login():
+    async def main():
+        auth = FakeAuth(delay=0.05)
+        server, dad = await _client(auth)
+        try:
+            urls = await asyncio.gather(*(dad.fetch_post_url(f"f{i}", telegram_id=7) for i in range(300)))
+        finally:
+            await dad.close()
+            await server.stop(None)
+        assert urls == [f"7|f{i}" for i in range(300)]
+        assert auth.logins == {7: 1}
+
+    asyncio.run(main())
+
+
+def test_expired_access_is_refreshed_once_without_reusing_rotated_token():
+    async def main():
+        auth = FakeAuth(delay=0.05)
+        server, dad = await _client(auth)
+        users = range(10)
+        try:
+            await asyncio.gather(*(dad.fetch_post_url("warmup", telegram_id=user) for user in users))
+            storage = dad.auth_interceptor.token_storage
+            for user in users:
+                # Просроченный access при действующем refresh токене
+                await storage.upsert_tokens(user, make_jwt(user, -60), auth.valid[user])
+            urls = await asyncio.gather(
+                *(dad.fetch_post_url(f"f{i}", telegram_id=user) for i in range(30) for user in users)
+            )
+        finally:
+            await dad.close()
+            await server.stop(None)
+        assert urls == [f"{user}|f{i}" for i in range(30) for user in users]
+        assert auth.refreshes == {user: 1 for user in users}
+        assert auth.reused == 0
+
+    asyncio.run(main())
+
+
+def test_not_found_is_shared_by_all_waiters():
+    async def main():
+        auth = FakeAuth(delay=0.05, unknown=frozenset({UNKNOWN_USER}))
+        server, dad = await _client(auth)
+        try:
+            results = await asyncio.gather(
+                *(dad.fetch_post_url(f"f{i}", telegram_id=UNKNOWN_USER) for i in range(20)), return_exceptions=True
+            )
+        finally:
+            await dad.close()
+            await server.stop(None)
+        assert all(isinstance(result, AuthLoginUserNotFoundError) for result in results)
+        assert auth.logins == {UNKNOWN_USER: 1}
+
+    asyncio.run(main())
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def main():
+        flight = SingleFlight()
+        runs = 0
+
+        async def login():
+            nonlocal runs
+            runs += 1
+            await asyncio.sleep(0.05)
+            return runs
+
+        leader = asyncio.create_task(flight.do("user", login))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(flight.do("user", login)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        assert await asyncio.gather(*waiters) == [2] * 5
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(main())
+
+
+def test_refresh_scheduler_tracks_only_scheduled_users():
+    async def main():
+        async def refresh(user_id):
+            raise RuntimeError("auth is down")
+
+        scheduler = TokenRefreshScheduler(refresh, lead=0, jitter=0, concurrency=1, idle_window=60)
+        for user_id in range(1000):
+            scheduler.touch(user_id)
+        assert scheduler.last_seen == {}
+
+        scheduler.schedule(1, time.time())
+        scheduler.touch(1)
+        assert set(scheduler.last_seen) == {1}
+
+        # Обновление не удалось и нового срока нет - пользователь забыт
+        await asyncio.sleep(0.05)
+        assert scheduler.last_seen == {}
+        await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_refresh_of_short_lived_token_is_not_scheduled_in_the_past():
+    async def main():
+        async def refresh(user_id):
+            pass
+
+        scheduler = TokenRefreshScheduler(refresh, lead=30, jitter=15, concurrency=1, idle_window=60)
+        now = time.time()
+        scheduler.schedule(1, now + 20)
+        scheduler.schedule(2, now + 600)
+        assert scheduler._deadlines[1] >= now + 10
+        assert now + 555 <= scheduler._deadlines[2] <= now + 570
+        await scheduler.stop()
+
+    asyncio.run(main())
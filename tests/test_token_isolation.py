@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+
+from anniegodfather.clients import DadClient
+from tests.fakes import FakeAuth, serve
+
+
+def test_concurrent_users_never_get_each_others_tokens():
+    """
+    Пользователь вызова передаётся через contextvar, а не через состояние interceptor.
+    Сотни пользователей через один канал: каждый ответ должен прийти с токеном своего.
+    """
+
+    async def main():
+        auth = FakeAuth()
+        server, target = await serve(auth)
+        dad = DadClient(target, "key", batching=False)
+        dad.get_url_cache = None
+        try:
+
+            async def call(user: int, number: int) -> tuple[str, str]:
+                await asyncio.sleep(random.random() * 0.01)
+                if number % 2:
+                    url = await dad.fetch_post_url(f"f{number}", telegram_id=user)
+                else:
+                    url = (await dad.fetch_get_url(f"f{number}", telegram_id=user)).url
+                return url, f"{user}|f{number}"
+
+            calls = [(random.randrange(200), number) for number in range(2000)]
+            results = await asyncio.gather(*(call(user, number) for user, number in calls))
+        finally:
+            await dad.close()
+            await server.stop(None)
+
+        leaked = [(got, expected) for got, expected in results if got != expected]
+        assert not leaked, f"{len(leaked)} calls used another user's token, e.g. {leaked[:3]}"
+        assert set(auth.logins) == {user for user, _ in calls}
+        assert all(count == 1 for count in auth.logins.values())
+
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from fakeredis import FakeAsyncRedis
+
+from anniegodfather.auth import RedisTokenStorage
+from tests.fakes import make_jwt
+
+
+def _counting(client: FakeAsyncRedis) -> list[bool]:
+    """Считает pipeline, открытые на клиенте: True - запись, False - пачка чтений"""
+    pipelines = []
+    pipeline = client.pipeline
+
+    def counted(transaction: bool = True, **kwargs):
+        pipelines.append(transaction)
+        return pipeline(transaction=transaction, **kwargs)
+
+    client.pipeline = counted
+    return pipelines
+
+
+def test_key_ttl_follows_jwt_expiry():
+    async def main():
+        client = FakeAsyncRedis()
+        storage = RedisTokenStorage(client=client)
+        await storage.upsert_tokens(1, make_jwt(1, 600), make_jwt(1, 7200))
+        # Без refresh токена ключ живёт до истечения access
+        await storage.upsert_tokens(2, make_jwt(2, 600), None)
+
+        # TokenData считает refresh истёкшим за 300 секунд до exp, access - за 10
+        assert 6890 <= await client.ttl(f"{RedisTokenStorage.prefix}1") <= 6900
+        assert 580 <= await client.ttl(f"{RedisTokenStorage.prefix}2") <= 590
+        await storage.close()
+
+    asyncio.run(main())
+
+
+def test_misses_in_one_iteration_are_read_in_one_pipeline():
+    async def main():
+        client = FakeAsyncRedis()
+        writer = RedisTokenStorage(client=client)
+        tokens = {user: (make_jwt(user, 600), make_jwt(user, 7200)) for user in range(50)}
+        for user, (access, refresh) in tokens.items():
+            await writer.upsert_tokens(user, access, refresh)
+
+        # Другая реплика с пустым L1
+        reader = RedisTokenStorage(client=client)
+        pipelines = _counting(client)
+        assert await asyncio.gather(*(reader.get_tokens(user) for user in tokens)) == list(tokens.values())
+        assert pipelines == [False]
+
+        # Повторно L1 отвечает без Redis
+        assert await reader.get_tokens(7) == tokens[7]
+        assert pipelines == [False]
+        await reader.close()
+
+    asyncio.run(main())
+
+
+def test_partial_upsert_merges_with_stored_pair():
+    async def main():
+        client = FakeAsyncRedis()
+        first = RedisTokenStorage(client=client)
+        refresh = make_jwt(1, 7200)
+        await first.upsert_tokens(1, make_jwt(1, 600), refresh)
+
+        # Реплика без L1 записи обновляет только access
+        second = RedisTokenStorage(client=client)
+        access = make_jwt(1, 900)
+        data = await second.upsert_tokens(1, access, None)
+        assert (data.access_token, data.refresh_token) == (access, refresh)
+        assert data.refresh_expires_at > time.time() + 6800
+
+        stored = await client.hgetall(f"{RedisTokenStorage.prefix}1")
+        assert stored == {b"access": access.encode(), b"refresh": refresh.encode()}
+        assert await RedisTokenStorage(client=client).get_tokens(1) == (access, refresh)
+        await second.close()
+
+    asyncio.run(main())